@@ -7,11 +7,19 @@ import streamlit as st
 import time
 import os
 import sys
+import uuid
 
 # configモジュールのパスを追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import YOU, BOT, CURRENT_MODE, MODES
-from main import LLMAPI, LLMAPIError
+from main import LLMAPI, LLMAPIError, warm_up_model, embed_text
+from app.keep_alive import get_keep_alive_scheduler
+from app.session_memory import get_session_memory_manager
+from app.request_scheduler import get_request_scheduler, PRIORITY_INTERACTIVE, PRIORITY_AUTO
+from app import profiling
+from app.profiling import profiled
+from app.semantic_cache import get_semantic_cache
+from app.hedging import get_hedge_policy
 
 class ChatApplication:
     """
@@ -27,7 +35,15 @@ class ChatApplication:
         try:
             self.initialize_session_state()
             self.setup_page()
-            self.llm = LLMAPI(mode=st.session_state.current_mode)
+            self.llm = LLMAPI(
+                mode=st.session_state.current_mode,
+                session_id=st.session_state.session_id
+            )
+            self.attach_you_line_sampler()
+            self.keep_alive_scheduler = get_keep_alive_scheduler(warm_up_model)
+            self.keep_alive_scheduler.warm_up_on_startup(MODES.keys())
+            self.keep_alive_scheduler.touch(st.session_state.current_mode)
+            self.memory_manager = get_session_memory_manager()
         except Exception as e:
             st.error(f"初期化エラー: {e}")
             raise
@@ -37,6 +53,10 @@ class ChatApplication:
         Streamlitのセッション状態を初期化します。
         メッセージ履歴、自動会話設定、現在のモードを管理します。
         """
+        # セッション識別子（メモリ管理用）
+        if 'session_id' not in st.session_state:
+            st.session_state.session_id = uuid.uuid4().hex
+
         # メッセージ関連
         if 'messages' not in st.session_state:
             st.session_state.messages = []
@@ -68,6 +88,14 @@ class ChatApplication:
         )
         st.title("AIチャット")
 
+    def attach_you_line_sampler(self):
+        """
+        会話ラインの抽選器をモードごとにセッション状態に保持します。
+        LLMAPIは再実行のたびに作り直されるため、重複なしの抽選状態をここで引き継ぎます。
+        """
+        samplers = st.session_state.setdefault('you_line_samplers', {})
+        self.llm.default_you_lines = samplers.setdefault(self.llm.current_mode, self.llm.default_you_lines)
+
     def get_mode_text(self):
         """
         現在のモードの表示名を取得します。
@@ -93,7 +121,10 @@ class ChatApplication:
         if mode != st.session_state.current_mode:
             st.session_state.current_mode = mode
             try:
-                self.llm = LLMAPI(mode=mode)  # 新しいモードでLLMAPIを初期化
+                self.llm = LLMAPI(mode=mode, session_id=st.session_state.session_id)  # 新しいモードでLLMAPIを初期化
+                self.attach_you_line_sampler()
+                self.keep_alive_scheduler.warm_up_async(mode)  # 選択したモードのモデルを事前ロード
+                self.keep_alive_scheduler.touch(mode)
                 st.session_state.messages = []  # メッセージ履歴をクリア
                 st.rerun()  # ページを再読み込み
             except Exception as e:
@@ -124,6 +155,114 @@ class ChatApplication:
                     value=5
                 )
 
+    def render_keep_alive_stats(self):
+        """
+        モデルの常駐維持の状態と、直近のウォームアップ・応答のロード時間を描画します。
+        """
+        status = self.keep_alive_scheduler.get_status()
+        with st.expander("モデルの常駐状態"):
+            st.write(f"常駐延長: {'実行中' if status['running'] else '停止中'}"
+                     f"（対象: {', '.join(status['active_modes']) or 'なし'}）")
+            for mode, result in status['last_results'].items():
+                if 'error' in result:
+                    st.write(f"{MODES[mode]['display_name']}: ウォームアップ失敗（{result['error']}）")
+                else:
+                    load_duration = (result.get('load_duration') or 0) / 1e9
+                    st.write(f"{MODES[mode]['display_name']}: ロード {load_duration:.2f}秒"
+                             f" / 所要 {result['elapsed']:.2f}秒")
+            # 最終レコードまで受信した応答のみ計測値がある（ウォームアップが効いていれば小さくなる）
+            last_stats = st.session_state.get('last_response_stats', {})
+            if 'load_duration' in last_stats:
+                st.write(f"直近の応答のロード時間: {last_stats['load_duration'] / 1e9:.2f}秒")
+
+    def render_memory_stats(self):
+        """
+        プロセス全体のセッションメモリ使用状況を描画します。
+        """
+        stats = self.memory_manager.get_stats()
+        with st.expander("メモリ使用状況"):
+            st.write(f"使用量: {stats['used_bytes'] / 1024:.1f} KB / {stats['budget_bytes'] / 1024:.1f} KB")
+            st.write(f"セッション数: {stats['sessions']}（退避中: {stats['evicted_sessions']}）")
+            st.write(f"退避回数: {stats['evictions']} / 復元回数: {stats['restores']}"
+                     f" / 期限切れ: {stats['expired']}")
+
+    def render_scheduler_stats(self):
+        """
+        リクエストスケジューラーの優先度クラスごとの状態を描画します。
+        """
+        stats = get_request_scheduler().get_stats()
+        with st.expander("リクエストスケジューラー"):
+            for priority, values in stats.items():
+                st.write(
+                    f"{priority}: 待ち {values['queue_depth']} / 実行 {values['running']}"
+                    f" / 停止 {values['paused']} / 平均待ち {values['avg_wait']:.2f}秒"
+                    f" / 最大待ち {values['max_wait']:.2f}秒 / キャンセル {values['cancelled']}"
+                )
+
+    def get_session_state_lists(self):
+        """
+        メモリ管理の対象とするセッション状態を取得します。
+
+        Returns:
+            dict: 状態名からセッションが保持するリストへの辞書
+        """
+        return {
+            'messages': st.session_state.messages,
+            'previous_messages': st.session_state.previous_messages,
+        }
+
+    def render_semantic_cache_stats(self):
+        """
+        セマンティックキャッシュのヒット率と削減時間を描画します（有効時のみ）。
+        """
+        semantic_cache = get_semantic_cache(embed_text)
+        if semantic_cache is None:
+            return
+
+        stats = semantic_cache.get_stats()
+        with st.expander("セマンティックキャッシュ"):
+            st.write(f"ヒット率: {stats['hit_rate']:.1%}（{stats['hits']} / {stats['hits'] + stats['misses']}）")
+            st.write(f"削減した待ち時間: {stats['latency_saved']:.1f}秒")
+            st.write(f"平均検索時間: {stats['avg_lookup_time'] * 1000:.1f}ms / 件数: {stats['entries']}")
+
+    def render_hedge_stats(self):
+        """
+        ヘッジリクエストの送信数と採用数、TTFTを描画します（有効時のみ）。
+        """
+        hedge_policy = get_hedge_policy()
+        if not hedge_policy.enabled:
+            return
+
+        stats = hedge_policy.get_stats()
+        with st.expander("ヘッジリクエスト"):
+            st.write(f"ヘッジ数: {stats['hedges']} / {stats['requests']}（予備の採用: {stats['hedge_wins']}）")
+            st.write(f"ヘッジまでの待ち時間: {stats['hedge_delay']:.2f}秒")
+            if stats['ttft_p50'] is not None:
+                st.write(f"TTFT p50: {stats['ttft_p50']:.2f}秒 / p99: {stats['ttft_p99']:.2f}秒")
+
+    def render_profiling_sidebar(self):
+        """
+        開発者向けに所要時間の長いスパンを描画します（プロファイリング有効時のみ）。
+        """
+        if not profiling.ENABLED:
+            return
+
+        st.markdown("### プロファイリング")
+        rows = profiling.recorder.get_slowest(limit=10)
+        st.table([
+            {
+                'スパン': row['name'],
+                '回数': row['count'],
+                '平均(ms)': round(row['avg'] * 1000, 1),
+                '最大(ms)': round(row['max'] * 1000, 1),
+                '直近(ms)': round(row['last'] * 1000, 1),
+            }
+            for row in rows
+        ])
+        if st.button("計測をリセット", key="reset_profiling"):
+            profiling.recorder.clear()
+
+    @profiled('ChatApplication.process_message')
     def process_message(self, message, is_auto=False):
         """
         メッセージを処理し、APIからの応答を取得して表示します。
@@ -153,8 +292,11 @@ class ChatApplication:
             thinking_placeholder.write(f"{BOT}が考え中...")
             
             try:
-                # APIリクエストを実行
-                response = self.llm.request(message)
+                # APIリクエストを実行（自動会話は対話より低い優先度で送信）
+                priority = PRIORITY_AUTO if is_auto else PRIORITY_INTERACTIVE
+                response = self.llm.request(message, priority=priority)
+                # LLMAPIは再実行のたびに作り直されるため、計測値はセッション状態に保持
+                st.session_state.last_response_stats = self.llm.last_stats
                 
                 if response and 'response' in response:
                     # プレースホルダーを応答で置き換え
@@ -184,6 +326,7 @@ class ChatApplication:
         except Exception as e:
             st.error(f"自動会話生成エラー: {e}")
 
+    @profiled('ChatApplication.render_chat_interface')
     def render_chat_interface(self):
         """
         チャットインターフェースを描画します。
@@ -202,9 +345,14 @@ class ChatApplication:
             except Exception as e:
                 st.error(f"メッセージ処理エラー: {e}")
 
-        # 連続自動会話の処理
-        if st.session_state.auto_conversation:
-            time.sleep(st.session_state.auto_interval)
+    def continue_auto_conversation(self):
+        """
+        連続自動会話の次の1回を実行し、再実行を要求します。
+        """
+        with self.memory_manager.activate(
+            st.session_state.session_id,
+            self.get_session_state_lists()
+        ):
             try:
                 self.auto_conversation_once()
                 st.rerun()
@@ -215,21 +363,45 @@ class ChatApplication:
     def run(self):
         """
         アプリケーションのメイン実行メソッド。
-        サイドバーとメインインターフェースを描画します。
+        サイドバーとメインインターフェースを描画し、連続自動会話を進めます。
         """
         try:
+            self.render_page()
+
+            # 連続自動会話の処理（待機時間が計測区間に含まれないよう描画の後で待つ）
+            if st.session_state.auto_conversation:
+                time.sleep(st.session_state.auto_interval)
+                self.continue_auto_conversation()
+        except Exception as e:
+            st.error(f"アプリケーションエラー: {e}")
+
+    @profiled('ChatApplication.render_page')
+    def render_page(self):
+        """
+        サイドバーとメインインターフェースを描画します。
+        """
+        # 実行中はセッション状態を退避対象から外し、退避済みなら復元する
+        with self.memory_manager.activate(
+            st.session_state.session_id,
+            self.get_session_state_lists()
+        ):
             # サイドバーの設定
             with st.sidebar:
                 st.markdown("### 基本設定")
                 self.render_mode_selector()
-                
+
                 st.markdown("### 自動会話設定")
                 self.render_auto_conversation_controls()
-            
+
+                self.render_keep_alive_stats()
+                self.render_memory_stats()
+                self.render_scheduler_stats()
+                self.render_semantic_cache_stats()
+                self.render_hedge_stats()
+                self.render_profiling_sidebar()
+
             # メインコンテンツ（チャットインターフェース）
             self.render_chat_interface()
-        except Exception as e:
-            st.error(f"アプリケーションエラー: {e}")
 
 def main():
     """
@@ -237,8 +409,10 @@ def main():
     ChatApplicationインスタンスを作成し実行します。
     """
     try:
-        app = ChatApplication()
-        app.run()
+        # プロファイリング有効時は一定の確率で再実行全体のCPUプロファイルを保存
+        with profiling.sampled_cpu_profile('rerun'):
+            app = ChatApplication()
+            app.run()
     except Exception as e:
         st.error(f"クリティカルエラー: {e}")
 
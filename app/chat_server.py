@@ -0,0 +1,364 @@
+"""
+LLMAPIをHTTP経由で利用するためのヘッドレスサーバーを提供するモジュール。
+1プロセスで多数のチャットセッションを保持し、バックエンドごとの待ち行列の上限を備えます。
+実行枠はリクエストスケジューラーが優先度クラスとバックエンドごとの上限に従って割り当てます。
+
+エンドポイント:
+    POST   /sessions                 セッションを作成（ボディ: {"mode": "normal"}）
+    POST   /sessions/<id>/messages   メッセージを送信し、応答をNDJSONでストリーミング
+                                     （ボディ: {"message": "...", "priority": "interactive"}、
+                                     ?stream=falseで一括応答）
+    GET    /sessions/<id>/history    会話履歴を取得
+    DELETE /sessions/<id>            セッションを削除
+    GET    /stats                    セッション数、バックエンドとスケジューラーの混雑状況などを取得
+
+使用例:
+    python -m app.chat_server --host 127.0.0.1 --port 8000
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from app.hedging import get_hedge_policy
+from app.main import LLMAPI, LLMAPIError, embed_text
+from app.request_scheduler import get_request_scheduler, PRIORITY_ORDER, PRIORITY_INTERACTIVE
+from app.semantic_cache import get_semantic_cache
+from app.single_flight import get_single_flight_group
+from app.settings import get_setting
+
+class ChatServerError(Exception):
+    """HTTPステータスコードを伴うサーバーエラー"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class BackendLimiter:
+    """
+    バックエンド（エンドポイントURL）ごとに受け付ける未完了リクエスト数を制限するクラス。
+
+    実行枠の割り当てはリクエストスケジューラーが優先度順に行うため、ここでは実行枠を保持せず、
+    実行中と待ち行列を合わせた数が上限に達した場合に即座に拒否するだけです。
+    """
+
+    def __init__(self, max_concurrency, max_queue):
+        """
+        BackendLimiterのコンストラクタ。
+
+        Args:
+            max_concurrency (int): バックエンドごとの同時実行数（スケジューラーの上限）
+            max_queue (int): バックエンドごとの待ち行列の上限
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.backends = {}  # URL -> 受け付け済みの未完了リクエスト数
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self, backend):
+        """
+        バックエンドへのリクエストを受け付けます。
+
+        Args:
+            backend (str): バックエンドのURL
+
+        Raises:
+            ChatServerError: 待ち行列が満杯の場合
+        """
+        with self._lock:
+            outstanding = self.backends.get(backend, 0)
+            if outstanding >= self.max_concurrency + self.max_queue:
+                raise ChatServerError(503, "バックエンドの待ち行列が満杯です")
+            self.backends[backend] = outstanding + 1
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.backends[backend] -= 1
+                if not self.backends[backend]:
+                    del self.backends[backend]
+
+class ChatSession:
+    """サーバー上の1チャットセッション"""
+
+    def __init__(self, mode):
+        self.session_id = uuid.uuid4().hex
+        self.llm = LLMAPI(mode=mode, session_id=self.session_id)
+        self.lock = threading.Lock()  # 同一セッションでの同時送信を防止
+        self.last_access = time.time()
+
+class ChatSessionStore:
+    """
+    チャットセッションを保持するクラス。
+    上限数に達した場合は、最も長く使われていないセッションを破棄します。
+    """
+
+    def __init__(self, max_sessions):
+        """
+        ChatSessionStoreのコンストラクタ。
+
+        Args:
+            max_sessions (int): 保持するセッション数の上限
+        """
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, mode=None):
+        """
+        セッションを作成します。
+
+        Args:
+            mode (str, optional): 使用するモード
+
+        Returns:
+            ChatSession: 作成したセッション
+
+        Raises:
+            ChatServerError: モードが不正な場合
+        """
+        try:
+            session = ChatSession(mode)
+        except ValueError as e:
+            raise ChatServerError(400, str(e))
+        except IOError as e:
+            raise ChatServerError(500, str(e))
+
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                idle_sessions = [s for s in self.sessions.values() if not s.lock.locked()]
+                if not idle_sessions:
+                    raise ChatServerError(503, "セッション数が上限に達しています")
+                oldest = min(idle_sessions, key=lambda s: s.last_access)
+                del self.sessions[oldest.session_id]
+            self.sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        """
+        セッションを取得します。
+
+        Raises:
+            ChatServerError: セッションが存在しない場合
+        """
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            raise ChatServerError(404, f"セッションが見つかりません: {session_id}")
+        session.last_access = time.time()
+        return session
+
+    def delete(self, session_id):
+        """
+        セッションを削除します。
+
+        Raises:
+            ChatServerError: セッションが存在しない場合
+        """
+        with self._lock:
+            if self.sessions.pop(session_id, None) is None:
+                raise ChatServerError(404, f"セッションが見つかりません: {session_id}")
+
+    def count(self):
+        """保持しているセッション数を取得"""
+        with self._lock:
+            return len(self.sessions)
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    """チャットサーバーのリクエストハンドラー"""
+
+    def log_message(self, format, *args):
+        """アクセスログを出力しない"""
+        pass
+
+    def send_json(self, status, body):
+        """JSON応答を送信"""
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json_body(self):
+        """
+        リクエストボディをJSONとして読み込みます。
+
+        Raises:
+            ChatServerError: Content-LengthまたはJSONとして不正な場合
+        """
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise ChatServerError(400, "Content-Lengthが不正です")
+        if length <= 0:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ChatServerError(400, "リクエストボディがJSONではありません")
+        if not isinstance(body, dict):
+            raise ChatServerError(400, "リクエストボディはオブジェクトである必要があります")
+        return body
+
+    def route(self, method):
+        """パスに応じて処理を振り分け、エラーをJSONで返します。"""
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split('/') if part]
+        query = parse_qs(parsed.query)
+        try:
+            if method == 'GET' and parts == ['stats']:
+                self.handle_stats()
+            elif method == 'POST' and parts == ['sessions']:
+                self.handle_create_session()
+            elif method == 'POST' and len(parts) == 3 and parts[0] == 'sessions' and parts[2] == 'messages':
+                stream = query.get('stream', ['true'])[0].lower() != 'false'
+                self.handle_send_message(parts[1], stream)
+            elif method == 'GET' and len(parts) == 3 and parts[0] == 'sessions' and parts[2] == 'history':
+                self.handle_history(parts[1])
+            elif method == 'DELETE' and len(parts) == 2 and parts[0] == 'sessions':
+                self.server.session_store.delete(parts[1])
+                self.send_json(200, {'deleted': parts[1]})
+            else:
+                raise ChatServerError(404, "エンドポイントが見つかりません")
+        except ChatServerError as e:
+            self.send_json(e.status, {'error': str(e)})
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    def handle_stats(self):
+        """セッション数、バックエンドとスケジューラーの混雑状況、キャッシュとヘッジの状況を返します。"""
+        semantic_cache = get_semantic_cache(embed_text)
+        single_flight = get_single_flight_group()
+        hedge_policy = get_hedge_policy()
+        self.send_json(200, {
+            'sessions': self.server.session_store.count(),
+            'backends': get_request_scheduler().get_backend_stats(),
+            'scheduler': get_request_scheduler().get_stats(),
+            'semantic_cache': semantic_cache.get_stats() if semantic_cache else None,
+            'single_flight': single_flight.get_stats() if single_flight else None,
+            'hedge': hedge_policy.get_stats() if hedge_policy.enabled else None,
+        })
+
+    def handle_create_session(self):
+        """セッションを作成します。"""
+        body = self.read_json_body()
+        session = self.server.session_store.create(body.get('mode'))
+        self.send_json(201, {'session_id': session.session_id, 'mode': session.llm.current_mode})
+
+    def handle_history(self, session_id):
+        """会話履歴を返します。"""
+        session = self.server.session_store.get(session_id)
+        with session.lock:
+            history = list(session.llm.chat_messages)
+        self.send_json(200, {'session_id': session_id, 'history': history})
+
+    def handle_send_message(self, session_id, stream):
+        """
+        メッセージを送信し、応答を返します。
+
+        ボディの"priority"でリクエストスケジューラーの優先度クラスを指定できます。
+
+        ストリーミング時は応答の断片を{"response": ...}のNDJSONで送り、
+        最後に{"done": true, "response": 全文}を送ります。
+        """
+        session = self.server.session_store.get(session_id)
+        body = self.read_json_body()
+        message = body.get('message')
+        priority = body.get('priority', PRIORITY_INTERACTIVE)
+        if not isinstance(message, str):
+            raise ChatServerError(400, "messageは文字列である必要があります")
+        if priority not in PRIORITY_ORDER:
+            raise ChatServerError(400, f"不正な優先度です: {priority}")
+        if not session.lock.acquire(blocking=False):
+            raise ChatServerError(409, "このセッションは応答を生成中です")
+
+        try:
+            with self.server.backend_limiter.admit(session.llm.get_endpoint_url()):
+                if not stream:
+                    try:
+                        response = session.llm.request(message, priority=priority)
+                    except LLMAPIError as e:
+                        raise ChatServerError(502, str(e))
+                    self.send_json(200, response)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                self.stream_response(session, message, priority)
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で切断した場合
+            pass
+        finally:
+            session.lock.release()
+
+    def stream_response(self, session, message, priority):
+        """
+        応答をNDJSONでストリーミングします。
+
+        クライアントが途中で切断した場合は生成を中断します（送信したユーザー発言はLLMAPIが履歴から取り除きます）。
+
+        Raises:
+            BrokenPipeError, ConnectionResetError: クライアントが切断した場合
+        """
+        stream = session.llm.request_stream(message, priority=priority)
+        try:
+            for chunk in stream:
+                self.write_record({'response': chunk})
+        except LLMAPIError as e:
+            # ヘッダー送信済みのため、エラーはレコードとして通知
+            self.write_record({'done': True, 'error': str(e)})
+            return
+        except (BrokenPipeError, ConnectionResetError):
+            stream.close()
+            raise
+        self.write_record({'done': True, 'response': session.llm.chat_messages[-1]['content']})
+
+    def write_record(self, record):
+        """NDJSONの1行を送信"""
+        self.wfile.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+class ChatServer(ThreadingHTTPServer):
+    """セッションストアとバックエンド制限を保持するHTTPサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self, server_address):
+        super().__init__(server_address, ChatRequestHandler)
+        self.session_store = ChatSessionStore(get_setting('SERVER_MAX_SESSIONS', 1000))
+        self.backend_limiter = BackendLimiter(
+            max_concurrency=get_request_scheduler().backend_limit or 0,
+            max_queue=get_setting('SERVER_BACKEND_QUEUE_LIMIT', 64),
+        )
+
+def main():
+    """コマンドラインからチャットサーバーを起動します。"""
+    parser = argparse.ArgumentParser(description='LLMチャットのヘッドレスHTTPサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    server = ChatServer((args.host, args.port))
+    print(f'チャットサーバーを起動しました: http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+1つのユーザー入力を複数の(モード, モデル)構成に同時に送信し、応答を比較するモジュール。
+構成ごとに独立した会話履歴を保持し、応答の断片を到着順に返します。
+全体の待ち時間は各構成の合計ではなく、最も遅いバックエンドとほぼ同じになります。
+"""
+
+import queue
+import threading
+import time
+from app.main import LLMAPI, LLMAPIError
+from app.request_scheduler import PRIORITY_INTERACTIVE
+
+# 比較イベントの種類
+EVENT_CHUNK = 'chunk'  # 応答の断片（payloadは文字列）
+EVENT_DONE = 'done'  # 応答の完了（payloadは計測値の辞書）
+EVENT_ERROR = 'error'  # 応答の失敗（payloadはエラーメッセージ）
+
+class ComparisonColumn:
+    """比較対象の1構成（1列）"""
+
+    def __init__(self, mode, model=None):
+        """
+        ComparisonColumnのコンストラクタ。
+
+        Args:
+            mode (str): 使用するモード
+            model (str, optional): 使用するモデル。Noneの場合はモード設定に従う
+
+        Raises:
+            ValueError: 指定されたモードが不正な場合
+        """
+        self.llm = LLMAPI(mode=mode, model=model)
+        self.label = f"{mode} / {self.llm.model}"
+        self.last_result = {}  # 直近の応答の計測値
+
+    def measure(self, started_at, first_chunk_at, finished_at, chunk_count):
+        """
+        応答の計測値を計算します。
+
+        生成速度は最終レコードのeval_count/eval_durationを優先し、
+        ない場合は受信した断片数（ストリームの1レコードは概ね1トークン）から推定します。
+
+        Args:
+            started_at (float): 送信時刻
+            first_chunk_at (Optional[float]): 最初の断片の受信時刻
+            finished_at (float): 完了時刻
+            chunk_count (int): 受信した断片数
+
+        Returns:
+            dict: TTFT（秒）、生成速度（トークン/秒）、所要時間（秒）
+        """
+        tokens_per_second = None
+        eval_count = self.llm.last_stats.get('eval_count')
+        eval_duration = self.llm.last_stats.get('eval_duration')
+        if eval_count and eval_duration:
+            tokens_per_second = eval_count / (eval_duration / 1e9)
+        elif first_chunk_at is not None and chunk_count > 1 and finished_at > first_chunk_at:
+            tokens_per_second = (chunk_count - 1) / (finished_at - first_chunk_at)
+        return {
+            'ttft': first_chunk_at - started_at if first_chunk_at is not None else None,
+            'tokens_per_second': tokens_per_second,
+            'elapsed': finished_at - started_at,
+        }
+
+class ComparisonSession:
+    """複数の構成に同じ入力を同時に送信する比較セッション"""
+
+    def __init__(self, targets):
+        """
+        ComparisonSessionのコンストラクタ。
+
+        Args:
+            targets (list): (モード, モデル)の組の一覧。モデルがNoneの場合はモード設定に従う
+
+        Raises:
+            ValueError: 構成が空の場合、またはモードが不正な場合
+        """
+        if not targets:
+            raise ValueError("比較する構成を1つ以上指定してください")
+        self.columns = [ComparisonColumn(mode, model) for mode, model in targets]
+
+    def iter_events(self, user_input, priority=PRIORITY_INTERACTIVE):
+        """
+        全ての構成に入力を同時に送信し、応答のイベントを到着順に返します。
+
+        反復を途中で打ち切った場合、受信中の応答は中断され会話履歴に追加されません。
+
+        Args:
+            user_input (str): ユーザーの入力
+            priority (str, optional): 優先度クラス
+
+        Yields:
+            tuple: (列番号, イベントの種類, 内容)
+        """
+        events = queue.Queue()
+        stop_event = threading.Event()
+
+        def run(index, column):
+            """1構成に送信して受信した断片をキューに積む"""
+            column.llm.last_stats = {}
+            started_at = time.perf_counter()
+            first_chunk_at = None
+            chunk_count = 0
+            stream = column.llm.request_stream(user_input, priority)
+            try:
+                for chunk in stream:
+                    if stop_event.is_set():
+                        stream.close()  # 中断した応答はLLMAPIが履歴から取り除く
+                        return
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    chunk_count += 1
+                    events.put((index, EVENT_CHUNK, chunk))
+                column.last_result = column.measure(
+                    started_at, first_chunk_at, time.perf_counter(), chunk_count
+                )
+                events.put((index, EVENT_DONE, column.last_result))
+            except (LLMAPIError, ValueError) as e:
+                events.put((index, EVENT_ERROR, str(e)))
+            except Exception as e:
+                events.put((index, EVENT_ERROR, f"予期しないエラー: {e}"))
+            finally:
+                stream.close()
+
+        for index, column in enumerate(self.columns):
+            threading.Thread(target=run, args=(index, column), daemon=True).start()
+
+        try:
+            remaining = len(self.columns)
+            while remaining:
+                index, kind, payload = events.get()
+                if kind != EVENT_CHUNK:
+                    remaining -= 1
+                yield index, kind, payload
+        finally:
+            stop_event.set()
+
+    def compare(self, user_input, priority=PRIORITY_INTERACTIVE):
+        """
+        全ての構成に入力を同時に送信し、全ての応答が揃うまで待ちます。
+
+        Args:
+            user_input (str): ユーザーの入力
+            priority (str, optional): 優先度クラス
+
+        Returns:
+            list: 列ごとの{'label', 'response', 'error', 'ttft', 'tokens_per_second', 'elapsed'}
+        """
+        results = [{'label': column.label, 'response': '', 'error': None} for column in self.columns]
+        for index, kind, payload in self.iter_events(user_input, priority):
+            if kind == EVENT_CHUNK:
+                results[index]['response'] += payload
+            elif kind == EVENT_DONE:
+                results[index].update(payload)
+            else:
+                results[index]['error'] = payload
+        return results
+
+    def get_histories(self):
+        """
+        構成ごとの会話履歴を取得します。
+
+        Returns:
+            list: 列ごとの役割付き会話履歴
+        """
+        return [list(column.llm.chat_messages) for column in self.columns]
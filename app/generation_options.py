@@ -0,0 +1,121 @@
+"""
+モードごとの生成オプション（Ollamaのoptions）を組み立てるモジュール。
+モード設定の'options'をそのまま送信し、'num_ctx_buckets'がある場合はプロンプトの推定トークン数に応じて
+num_ctxを段階的に選びます。num_ctxが変わるとバックエンドでモデルの再ロードが発生するため、
+段階は粗く区切り、(バックエンド, モデル)ごとにプロセス内で一度拡大したnum_ctxは縮小しません。
+セッションやウォームアップごとに異なるnum_ctxを送ると、同じモデルの再ロードが繰り返されるためです。
+
+ただし最後のリクエスト（ウォームアップを含む）からモデルの常駐時間（keep_alive）が過ぎた場合は、
+モデルがアンロードされて次回はいずれにしてもロードし直すため、拡大したnum_ctxを破棄して最小の段階から選び直します。
+"""
+
+import re
+import threading
+import time
+
+# num_predictが未指定の場合に応答用として確保するトークン数
+DEFAULT_OUTPUT_RESERVE = 256
+
+# モード設定にkeep_aliveがない場合の常駐時間（Ollamaの既定値、秒）
+DEFAULT_KEEP_ALIVE_SECONDS = 300
+
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# (バックエンドのURL, モデル名) -> {'num_ctx': これまでに使用した最大のnum_ctx, 'last_used': 最後に使用した時刻}
+_num_ctx_high_water = {}
+_num_ctx_lock = threading.Lock()
+
+def estimate_tokens(text):
+    """
+    テキストのトークン数を概算します。
+
+    ASCII文字は4文字で1トークン、それ以外（日本語など）は1文字で1トークンとして数えます。
+
+    Args:
+        text (str): テキスト
+
+    Returns:
+        int: 推定トークン数
+    """
+    ascii_count = len(text.encode('ascii', errors='ignore'))
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+def parse_keep_alive(value):
+    """
+    keep_aliveの値（秒数、または'5m'や'1h30m'などの期間の文字列）を秒数に変換します。
+
+    Args:
+        value (Union[int, float, str, None]): keep_aliveの値（Noneの場合はOllamaの既定値）
+
+    Returns:
+        Optional[float]: 常駐時間（秒）。負の値（無期限）や解釈できない値の場合はNone。
+    """
+    if value is None:
+        return DEFAULT_KEEP_ALIVE_SECONDS
+    text = str(value).strip()
+    try:
+        seconds = float(text)
+    except ValueError:
+        match = re.fullmatch(r'(-?)((?:\d+(?:\.\d+)?(?:ms|h|m|s))+)', text)
+        if match is None:
+            return None
+        seconds = sum(
+            float(number) * _DURATION_UNITS[unit]
+            for number, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', match.group(2))
+        )
+        if match.group(1):
+            seconds = -seconds
+    return None if seconds < 0 else seconds
+
+def select_num_ctx(required_tokens, buckets, current=None):
+    """
+    必要なトークン数を収められる最小の段階を選びます。
+
+    Args:
+        required_tokens (int): プロンプトと応答に必要なトークン数
+        buckets (list): num_ctxの段階の一覧
+        current (int, optional): 現在のnum_ctx。これより小さい段階は選ばない
+
+    Returns:
+        int: num_ctx（全ての段階を超える場合は最大の段階）
+    """
+    candidates = sorted(buckets)
+    selected = next((bucket for bucket in candidates if bucket >= required_tokens), candidates[-1])
+    if current is not None:
+        selected = max(selected, current)
+    return selected
+
+def build_generation_options(mode_config, prompt_tokens=0, backend=None):
+    """
+    モード設定からリクエストに含める生成オプションを組み立てます。
+
+    Args:
+        mode_config (dict): モード設定
+        prompt_tokens (int, optional): プロンプトの推定トークン数
+        backend (tuple, optional): (バックエンドのURL, モデル名)。指定した場合、
+                                   そのモデルでこれまでに使用した最大のnum_ctxより小さい段階は選ばない
+                                   （最後の使用からkeep_aliveが過ぎている場合を除く）
+
+    Returns:
+        dict: 生成オプション
+    """
+    options = dict(mode_config.get('options') or {})
+    buckets = mode_config.get('num_ctx_buckets')
+    if not buckets:
+        return options
+
+    # 応答用にnum_predict分（上限がない場合は既定値）を確保する
+    num_predict = options.get('num_predict')
+    reserve = num_predict if num_predict and num_predict > 0 else DEFAULT_OUTPUT_RESERVE
+    now = time.monotonic()
+    keep_alive = parse_keep_alive(mode_config.get('keep_alive'))
+    with _num_ctx_lock:
+        high_water = _num_ctx_high_water.get(backend)
+        if high_water is not None and keep_alive is not None and now - high_water['last_used'] > keep_alive:
+            # モデルはアンロード済みのため、拡大したnum_ctxを維持する必要はない
+            high_water = None
+        num_ctx = select_num_ctx(prompt_tokens + reserve, buckets, high_water and high_water['num_ctx'])
+        if backend is not None:
+            _num_ctx_high_water[backend] = {'num_ctx': num_ctx, 'last_used': now}
+    options['num_ctx'] = num_ctx
+    return options
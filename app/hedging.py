@@ -0,0 +1,404 @@
+"""
+ヘッジリクエストによって応答開始の遅延（テイルレイテンシ）を抑えるモジュール。
+最初のトークンが直近のTTFT（最初のトークンまでの時間）の指定パーセンタイル以内に届かない場合、
+同じリクエストを予備のバックエンドにも送信し、先にトークンを返した方を採用します。
+ヘッジの送信数は全リクエストに対する割合（予算）で制限します。
+
+不採用になった送信は、応答ヘッダーの受信前であっても接続を切断してバックエンドの生成を止めます。
+"""
+
+import math
+import queue
+import socket
+import threading
+import time
+from collections import deque
+import requests
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from app.settings import get_setting
+
+class TTFTTracker:
+    """直近のTTFTを保持し、パーセンタイルを計算するクラス"""
+
+    def __init__(self, window=200):
+        """
+        TTFTTrackerのコンストラクタ。
+
+        Args:
+            window (int, optional): 保持するサンプル数
+        """
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, ttft):
+        """
+        TTFTを記録します。
+
+        Args:
+            ttft (float): 最初のトークンまでの時間（秒）
+        """
+        with self._lock:
+            self.samples.append(ttft)
+
+    def percentile(self, p):
+        """
+        TTFTのパーセンタイル値を計算します。
+
+        Args:
+            p (float): パーセンタイル（0〜100）
+
+        Returns:
+            Optional[float]: パーセンタイル値。サンプルがない場合はNone。
+        """
+        with self._lock:
+            values = sorted(self.samples)
+        if not values:
+            return None
+        index = min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))
+        return values[index]
+
+    def __len__(self):
+        with self._lock:
+            return len(self.samples)
+
+class HedgeBudget:
+    """ヘッジの送信数を全リクエストに対する割合で制限するクラス"""
+
+    def __init__(self, ratio, window=1000):
+        """
+        HedgeBudgetのコンストラクタ。
+
+        Args:
+            ratio (float): ヘッジ送信数の上限（全リクエストに対する割合、0.05 = 5%）
+            window (int, optional): 集計の対象とする直近のリクエスト数の目安
+        """
+        self.ratio = ratio
+        self.window = window
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        """リクエストを1件記録します。集計が窓を超えたら古い分を半減させます。"""
+        with self._lock:
+            self.requests += 1
+            if self.requests > self.window:
+                self.requests //= 2
+                self.hedges //= 2
+
+    def try_spend(self):
+        """
+        ヘッジを1件送信できるか判定し、可能であれば予算を消費します。
+
+        Returns:
+            bool: 送信可能な場合はTrue
+        """
+        with self._lock:
+            if self.hedges + 1 > self.ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def refund(self):
+        """try_spend()で消費した予算を戻します（ヘッジを送信しなかった場合）。"""
+        with self._lock:
+            self.hedges = max(0, self.hedges - 1)
+
+class _TrackedConnectionMixin:
+    """接続の確立時に、所有するセッションへ接続を登録する"""
+
+    owner = None  # 所有するAbortableSession（セッションごとのサブクラスで設定）
+
+    def connect(self):
+        super().connect()
+        self.owner.register(self)
+
+class AbortableSession(requests.Session):
+    """
+    使用中の接続も含めて、別スレッドからabort()で切断できるセッション。
+
+    Session.close()はプールに戻った接続しか閉じないため、応答ヘッダーを待っている
+    requests.postは中断できません。このセッションは確立した接続のソケットを記録し、
+    abort()でソケットを直接shutdownして、待機中の送受信をただちに失敗させます。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.aborted = False
+        self._connections = []
+        self._lock = threading.Lock()
+        connection_classes = {
+            'http': (HTTPConnectionPool, HTTPConnection),
+            'https': (HTTPSConnectionPool, HTTPSConnection),
+        }
+        pool_classes = {
+            scheme: type(pool_class.__name__, (pool_class,), {
+                'ConnectionCls': type(connection_class.__name__, (_TrackedConnectionMixin, connection_class), {
+                    'owner': self,
+                }),
+            })
+            for scheme, (pool_class, connection_class) in connection_classes.items()
+        }
+        for adapter in self.adapters.values():
+            adapter.poolmanager.pool_classes_by_scheme = pool_classes
+
+    def register(self, connection):
+        """
+        確立した接続を登録します。中断済みの場合はただちに切断します。
+
+        Args:
+            connection (urllib3.connection.HTTPConnection): 確立した接続
+        """
+        with self._lock:
+            if not self.aborted:
+                self._connections.append(connection)
+                return
+        self._shutdown(connection)
+
+    def abort(self):
+        """全ての接続を切断します。以降に確立した接続もただちに切断されます。"""
+        with self._lock:
+            self.aborted = True
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            self._shutdown(connection)
+
+    @staticmethod
+    def _shutdown(connection):
+        """ソケットをshutdownする（受信待ちのスレッドも戻る。エラーは無視）"""
+        sock = connection.sock
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class _Attempt:
+    """1つのバックエンドへの送信"""
+
+    def __init__(self, index, url, ticket=None):
+        self.index = index
+        self.url = url
+        self.ticket = ticket  # 主バックエンド以外への送信で取得した実行枠
+        self.session = AbortableSession()
+        self.cancelled = False
+        self.started_at = time.monotonic()
+
+    def cancel(self):
+        """送信をキャンセルし、応答ヘッダーの受信前であっても接続を切断します。"""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.session.abort()
+
+class HedgePolicy:
+    """ヘッジの判定と、複数バックエンドへの送信・採用を行うクラス"""
+
+    def __init__(self, enabled, percentile, budget_ratio, min_samples, default_delay):
+        """
+        HedgePolicyのコンストラクタ。
+
+        Args:
+            enabled (bool): ヘッジを有効にするか
+            percentile (float): ヘッジまでの待ち時間とするTTFTのパーセンタイル
+            budget_ratio (float): ヘッジ送信数の上限（全リクエストに対する割合）
+            min_samples (int): パーセンタイルを使用するのに必要なサンプル数
+            default_delay (float): サンプルが不足している間のヘッジまでの待ち時間（秒）
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.tracker = TTFTTracker()
+        self.budget = HedgeBudget(budget_ratio)
+        self.hedge_wins = 0  # 予備のバックエンドが採用された回数
+        self._lock = threading.Lock()
+
+    def get_hedge_delay(self):
+        """
+        ヘッジを送信するまでの待ち時間を取得します。
+
+        Returns:
+            float: 待ち時間（秒）
+        """
+        if len(self.tracker) < self.min_samples:
+            return self.default_delay
+        return self.tracker.percentile(self.percentile)
+
+    def get_stats(self):
+        """
+        ヘッジの状況を取得します。
+
+        Returns:
+            dict: リクエスト数、ヘッジ数、予備の採用数、待ち時間、TTFTのp50/p99
+        """
+        with self._lock:
+            hedge_wins = self.hedge_wins
+        return {
+            'requests': self.budget.requests,
+            'hedges': self.budget.hedges,
+            'hedge_wins': hedge_wins,
+            'hedge_delay': self.get_hedge_delay(),
+            'ttft_p50': self.tracker.percentile(50),
+            'ttft_p99': self.tracker.percentile(99),
+        }
+
+    def iter_records(self, urls, request_body, open_func, iter_func, acquire_func=None):
+        """
+        ヘッジ付きでリクエストを送信し、採用した応答をレコード単位で返します。
+
+        先頭のURLに送信し、待ち時間内に最初のレコードが届かず予算が残っていれば
+        次のURLにも送信します。最初にレコードを返した送信を採用し、他はただちにキャンセルします。
+        送信が失敗した場合は、予算に関係なく次のURLに切り替えます。
+
+        先頭以外のURLに送信する際はacquire_funcで送信先の実行枠を取得し、取得できない場合は
+        そのURLへの送信を見送ります（主バックエンドの実行枠は呼び出し側で取得します）。
+
+        Args:
+            urls (list): 送信先URLの一覧（先頭が主バックエンド）
+            request_body (dict): リクエストボディ
+            open_func (Callable): (url, request_body, session)を受け取り応答オブジェクトを返す関数
+            iter_func (Callable): 応答オブジェクトを受け取りレコードを返すジェネレータ関数
+            acquire_func (Callable, optional): URLを受け取り、checkpoint()とrelease()を持つ
+                実行枠を返す関数。空きがない場合はNoneを返す
+
+        Yields:
+            dict: 採用した応答のレコード
+        """
+        self.budget.record_request()
+        request_started = time.monotonic()
+        events = queue.Queue()
+        attempts = []
+
+        def run(attempt):
+            """送信して受信したレコードをキューに積む"""
+            records = None
+            try:
+                response = open_func(attempt.url, request_body, attempt.session)
+                records = iter_func(response)
+                for record in records:
+                    if attempt.cancelled:
+                        return
+                    if attempt.ticket is not None:
+                        attempt.ticket.checkpoint()
+                    events.put((attempt, 'record', record))
+                events.put((attempt, 'end', None))
+            except Exception as e:
+                events.put((attempt, 'error', e))
+            finally:
+                if records is not None:
+                    records.close()
+                attempt.session.close()
+                if attempt.ticket is not None:
+                    attempt.ticket.release()
+
+        def start(index):
+            """
+            指定したURLへの送信を開始します。
+
+            Returns:
+                bool: 開始した場合はTrue。送信先の実行枠を取得できなかった場合はFalse
+            """
+            ticket = None
+            if index > 0 and acquire_func is not None:
+                ticket = acquire_func(urls[index])
+                if ticket is None:
+                    return False
+            attempt = _Attempt(len(attempts), urls[index], ticket)
+            attempts.append(attempt)
+            threading.Thread(target=run, args=(attempt,), daemon=True).start()
+            return True
+
+        def start_next():
+            """実行枠を取得できる次のURLへの送信を開始します。開始できた場合はTrue"""
+            nonlocal next_index
+            while next_index < len(urls):
+                next_index += 1
+                if start(next_index - 1):
+                    return True
+            return False
+
+        start(0)
+        next_index = 1
+        hedge_deadline = time.monotonic() + self.get_hedge_delay()
+        hedge_decided = False  # ヘッジは1回まで判定する
+        finished = []  # 最初のレコードを返さずに終了した送信と、そのエラー
+        winner = None
+        first_record = None
+
+        try:
+            # 最初のレコードを返した送信を採用する
+            while winner is None:
+                timeout = None
+                if not hedge_decided and next_index < len(urls):
+                    timeout = max(0.0, hedge_deadline - time.monotonic())
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_decided = True
+                    # 送信先の実行枠を取得できなかった場合は予算を戻す
+                    if self.budget.try_spend() and not start_next():
+                        self.budget.refund()
+                    continue
+
+                if kind == 'record':
+                    winner, first_record = attempt, payload
+                    break
+
+                finished.append((attempt, payload))
+                # 失敗した場合は次のバックエンドに切り替え
+                if not start_next() and len(finished) == len(attempts):
+                    errors = [error for _, error in finished if error is not None]
+                    if errors:
+                        raise errors[0]
+                    return
+
+            # TTFTは元のリクエストの開始から計測する。予備が採用された場合、この値は
+            # 主バックエンドの経過時間と等しく、その実際のTTFTの下限として扱われる
+            # （予備の送信開始からの時間を記録すると、遅い主バックエンドの分布が隠れてしまう）
+            self.tracker.record(time.monotonic() - request_started)
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+            if winner.index > 0:
+                with self._lock:
+                    self.hedge_wins += 1
+
+            yield first_record
+            while True:
+                attempt, kind, payload = events.get()
+                if attempt is not winner:
+                    continue
+                if kind == 'record':
+                    yield payload
+                elif kind == 'end':
+                    return
+                else:
+                    raise payload
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+_policy = None
+_policy_lock = threading.Lock()
+
+def get_hedge_policy():
+    """
+    プロセス内で共有するHedgePolicyを取得します。
+
+    Returns:
+        HedgePolicy: 共有ポリシー
+    """
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy(
+                enabled=get_setting('HEDGE_ENABLED', False),
+                percentile=get_setting('HEDGE_PERCENTILE', 95),
+                budget_ratio=get_setting('HEDGE_BUDGET_RATIO', 0.05),
+                min_samples=get_setting('HEDGE_MIN_SAMPLES', 20),
+                default_delay=get_setting('HEDGE_DEFAULT_DELAY', 2.0),
+            )
+        return _policy
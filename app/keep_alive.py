@@ -0,0 +1,157 @@
+"""
+モデルのウォームアップと常駐維持を行うモジュール。
+起動時やモード選択時にモデルを事前ロードし、利用中はバックグラウンドで定期的に常駐を延長します。
+"""
+
+import threading
+import time
+from app.settings import get_setting
+
+class KeepAliveScheduler:
+    """
+    モデルの常駐を維持するバックグラウンドスケジューラー。
+    最後の利用からidle_timeout秒を過ぎたモードは常駐延長を停止し、
+    延長対象がなくなるとスレッドを終了します。
+    """
+
+    def __init__(self, warm_up_func, interval=240, idle_timeout=1800):
+        """
+        KeepAliveSchedulerのコンストラクタ。
+
+        Args:
+            warm_up_func (Callable[[str], dict]): モード名を受け取りウォームアップを行う関数
+            interval (float, optional): 常駐延長の間隔（秒）。keep_aliveより短く設定する
+            idle_timeout (float, optional): 常駐延長を停止するまでのアイドル時間（秒）
+        """
+        self.warm_up_func = warm_up_func
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.last_activity = {}  # モードごとの最終利用時刻
+        self.last_results = {}  # モードごとの直近のウォームアップ結果
+        self.startup_done = False  # 起動時ウォームアップ済みフラグ
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def warm_up(self, mode):
+        """
+        指定されたモードのモデルをウォームアップし、結果を記録します。
+
+        Args:
+            mode (str): ウォームアップするモード
+
+        Returns:
+            dict: ウォームアップ結果（失敗時は'error'キーを含む）
+        """
+        started_at = time.time()
+        try:
+            response = self.warm_up_func(mode)
+            result = {
+                'load_duration': response.get('load_duration'),
+                'elapsed': time.time() - started_at,
+            }
+        except Exception as e:
+            result = {'error': str(e), 'elapsed': time.time() - started_at}
+        result['timestamp'] = time.time()
+
+        with self._lock:
+            self.last_results[mode] = result
+        return result
+
+    def warm_up_async(self, mode):
+        """
+        ウォームアップをバックグラウンドで実行します。
+
+        Args:
+            mode (str): ウォームアップするモード
+        """
+        threading.Thread(target=self.warm_up, args=(mode,), daemon=True).start()
+
+    def warm_up_on_startup(self, modes):
+        """
+        プロセス起動後の初回呼び出し時のみ、全モードをバックグラウンドでウォームアップします。
+
+        Args:
+            modes (Iterable[str]): ウォームアップするモードの一覧
+        """
+        with self._lock:
+            if self.startup_done:
+                return
+            self.startup_done = True
+
+        for mode in modes:
+            self.warm_up_async(mode)
+
+    def touch(self, mode):
+        """
+        モードの利用を記録し、必要に応じて常駐延長スレッドを開始します。
+
+        Args:
+            mode (str): 利用されたモード
+        """
+        with self._lock:
+            self.last_activity[mode] = time.time()
+            if self._thread is None or not self._thread.is_alive():
+                self._wake_event.clear()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """常駐延長スレッドを停止します。"""
+        with self._lock:
+            self.last_activity.clear()
+        self._wake_event.set()
+
+    def get_status(self):
+        """
+        スケジューラーの状態を取得します。
+
+        Returns:
+            dict: 実行状態、延長対象モード、直近のウォームアップ結果
+        """
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'active_modes': list(self.last_activity.keys()),
+                'last_results': dict(self.last_results),
+            }
+
+    def _run(self):
+        """常駐延長ループ。アイドル状態のモードを除外し、残りのモードをウォームアップします。"""
+        while not self._wake_event.wait(self.interval):
+            now = time.time()
+            with self._lock:
+                for mode, last in list(self.last_activity.items()):
+                    if now - last > self.idle_timeout:
+                        del self.last_activity[mode]
+                active_modes = list(self.last_activity.keys())
+                if not active_modes:
+                    # 延長対象がなくなったらスレッドを終了（次回のtouchで再開）
+                    self._thread = None
+                    return
+
+            for mode in active_modes:
+                self.warm_up(mode)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_keep_alive_scheduler(warm_up_func):
+    """
+    プロセス内で共有するKeepAliveSchedulerを取得します。
+
+    Args:
+        warm_up_func (Callable[[str], dict]): 初回生成時に使用するウォームアップ関数
+
+    Returns:
+        KeepAliveScheduler: 共有スケジューラー
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = KeepAliveScheduler(
+                warm_up_func,
+                interval=get_setting('KEEP_ALIVE_INTERVAL', 240),
+                idle_timeout=get_setting('KEEP_ALIVE_IDLE_TIMEOUT', 1800),
+            )
+        return _scheduler
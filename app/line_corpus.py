@@ -0,0 +1,455 @@
+"""
+大規模な会話ラインファイルを扱うためのモジュール。
+ファイルをメモリマップし、行の位置（オフセット）の索引をファイルに保存して再利用します。
+索引はファイルの更新時刻またはサイズが変わった場合のみ作り直すため、起動時間と
+セッションごとのメモリ使用量は行数によらずほぼ一定です。
+
+重み付きの場合、各行を「重み<TAB>テキスト」の形式で記述します（重みを省略した行は1）。
+
+メモリマップ中のファイルをその場で切り詰めると、切り詰められた範囲の読み込みでSIGBUSが発生し
+プロセスが異常終了します。読み込み前にファイルサイズを確認しますが、確認と読み込みの間の変更は防げないため、
+会話ラインファイルを更新する場合は別ファイルに書き出してからos.replaceで置き換えてください。
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import random
+import struct
+import threading
+from array import array
+from app.paths import ROOT_DIR
+from app.settings import get_setting
+
+# 索引ファイルのヘッダー（識別子, 元ファイルの更新時刻, サイズ, 行数, 重み付きか）
+INDEX_HEADER = struct.Struct('=8sQQQQ')
+INDEX_MAGIC = b'LCIDX001'
+
+FEISTEL_ROUNDS = 6  # 行番号の置換に使用するFeistelネットワークの段数
+
+class LineIndex:
+    """
+    メモリマップした会話ラインファイルと、その索引。
+
+    索引ファイルもメモリマップし、行の開始・終了位置や重みのテーブルを読み込まずに参照します。
+    """
+
+    def __init__(self, path, index_path, weighted):
+        """
+        LineIndexのコンストラクタ。索引が古い場合は作り直します。
+
+        Args:
+            path (str): 会話ラインファイルのパス
+            index_path (str): 索引ファイルのパス
+            weighted (bool): 行を重み付きとして扱うか
+
+        Raises:
+            FileNotFoundError: 会話ラインファイルが存在しない場合
+            IOError: ファイルの読み込みまたは索引の保存に失敗した場合
+        """
+        stat = os.stat(path)
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.weighted = weighted
+        self.count = 0
+        self.data = None  # 会話ラインファイルのメモリマップ
+
+        if self.size:
+            with open(path, 'rb') as file:
+                self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if not self.load_index(index_path):
+            self.build_index(index_path)
+
+    def load_index(self, index_path):
+        """
+        保存済みの索引を読み込みます。元ファイルと一致しない場合は読み込みません。
+
+        Args:
+            index_path (str): 索引ファイルのパス
+
+        Returns:
+            bool: 読み込めた場合はTrue
+        """
+        try:
+            with open(index_path, 'rb') as file:
+                index_data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        if len(index_data) < INDEX_HEADER.size:
+            index_data.close()
+            return False
+
+        magic, mtime_ns, size, count, weighted = INDEX_HEADER.unpack_from(index_data)
+        expected_size = INDEX_HEADER.size + count * 8 * (4 if weighted else 2)
+        if (magic != INDEX_MAGIC or mtime_ns != self.mtime_ns or size != self.size
+                or bool(weighted) != self.weighted or len(index_data) != expected_size):
+            index_data.close()
+            return False
+
+        self.attach(index_data, count)
+        return True
+
+    def build_index(self, index_path):
+        """
+        会話ラインファイルを走査して索引を作成し、保存します。
+
+        空行は除外し、重み付きの場合はVoseのエイリアス法のテーブルも作成します。
+
+        Args:
+            index_path (str): 索引ファイルのパス
+
+        Raises:
+            IOError: 索引の保存に失敗した場合
+        """
+        starts = array('Q')
+        ends = array('Q')
+        weights = []
+        position = 0
+        while self.data is not None and position < self.size:
+            end = self.data.find(b'\n', position)
+            if end < 0:
+                end = self.size
+            line = self.data[position:end]
+            start = position
+            weight = 1.0
+            if self.weighted:
+                weight_text, tab, _ = line.partition(b'\t')
+                if tab:
+                    try:
+                        weight = float(weight_text)
+                        start = position + len(weight_text) + 1
+                        line = line[len(weight_text) + 1:]
+                    except ValueError:
+                        weight = 1.0
+            # 元の実装と同じく前後の空白を除いて空になる行は除外する
+            if line.decode('utf-8', errors='replace').strip() and weight > 0 and math.isfinite(weight):
+                starts.append(start)
+                ends.append(end)
+                weights.append(weight)
+            position = end + 1
+
+        tables = [starts, ends]
+        if self.weighted:
+            tables.extend(self.build_alias_table(weights))
+
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        # 書き込み途中の索引を読まないよう、一時ファイル経由で置き換える
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(INDEX_HEADER.pack(
+                    INDEX_MAGIC, self.mtime_ns, self.size, len(starts), int(self.weighted)
+                ))
+                for table in tables:
+                    table.tofile(file)
+            os.replace(temp_path, index_path)
+        except OSError as e:
+            raise IOError(f"会話ラインの索引の保存に失敗しました: {e}")
+
+        with open(index_path, 'rb') as file:
+            self.attach(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), len(starts))
+
+    @staticmethod
+    def build_alias_table(weights):
+        """
+        重み付き抽選をO(1)で行うためのエイリアステーブルを作成します（Voseの方法）。
+
+        Args:
+            weights (list): 行ごとの重み
+
+        Returns:
+            tuple: (採用確率のarray('d'), 別名の行番号のarray('Q'))
+        """
+        count = len(weights)
+        probabilities = array('d', [0.0]) * count
+        aliases = array('Q', [0]) * count
+        if not count:
+            return probabilities, aliases
+
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # 誤差で残ったものは確率1とする
+        for i in small + large:
+            probabilities[i] = 1.0
+            aliases[i] = i
+        return probabilities, aliases
+
+    def attach(self, index_data, count):
+        """
+        メモリマップした索引の各テーブルを参照できるようにします。
+
+        Args:
+            index_data (mmap.mmap): 索引ファイルのメモリマップ
+            count (int): 行数
+        """
+        self.index_data = index_data
+        self.count = count
+        table_size = count * 8
+        view = memoryview(index_data)[INDEX_HEADER.size:]
+        self.starts = view[:table_size].cast('Q')
+        self.ends = view[table_size:table_size * 2].cast('Q')
+        if self.weighted:
+            self.probabilities = view[table_size * 2:table_size * 3].cast('d')
+            self.aliases = view[table_size * 3:table_size * 4].cast('Q')
+
+    def get_line(self, number):
+        """
+        指定した行を取得します。
+
+        Args:
+            number (int): 行番号（空行を除いた0始まりの番号）
+
+        Returns:
+            str: 前後の空白を除いた行
+
+        Raises:
+            IOError: ファイルが索引の作成後に縮小された場合
+        """
+        end = self.ends[number]
+        # 縮小されたファイルの範囲外を読むとSIGBUSになるため、現在のサイズを確認する
+        if end > self.data.size():
+            raise IOError("会話ラインファイルが索引の作成後に縮小されました")
+        return self.data[self.starts[number]:end].decode('utf-8', errors='replace').strip()
+
+    def sample_number(self, rng):
+        """
+        行番号を1つ抽選します。重み付きの場合は重みに比例した確率で選びます。
+
+        Args:
+            rng (random.Random): 乱数生成器
+
+        Returns:
+            int: 行番号
+        """
+        number = rng.randrange(self.count)
+        if self.weighted and rng.random() >= self.probabilities[number]:
+            number = self.aliases[number]
+        return number
+
+class LineCorpus:
+    """
+    1つの会話ラインファイルを表すクラス。プロセス内の全セッションで共有します。
+    参照のたびにファイルの更新を確認し、更新されていれば索引を作り直します。
+    """
+
+    def __init__(self, path, index_dir, weighted=False):
+        """
+        LineCorpusのコンストラクタ。
+
+        Args:
+            path (str): 会話ラインファイルのパス
+            index_dir (str): 索引ファイルの保存先
+            weighted (bool, optional): 行を重み付きとして扱うか
+
+        Raises:
+            FileNotFoundError: 会話ラインファイルが存在しない場合
+            IOError: ファイルの読み込みまたは索引の保存に失敗した場合
+        """
+        self.path = os.path.abspath(path)
+        self.weighted = weighted
+        path_hash = hashlib.sha256(self.path.encode('utf-8')).hexdigest()[:16]
+        suffix = '.weighted.idx' if weighted else '.idx'
+        self.index_path = os.path.join(index_dir, path_hash + suffix)
+        self.version = 0  # 索引を作り直すたびに増える
+        self._lock = threading.Lock()
+        self.index = LineIndex(self.path, self.index_path, weighted)
+
+    def refresh(self):
+        """
+        ファイルが更新されていれば索引を作り直します。
+
+        Returns:
+            LineIndex: 最新の索引
+
+        Raises:
+            FileNotFoundError: 会話ラインファイルが存在しない場合
+            IOError: ファイルの読み込みまたは索引の保存に失敗した場合
+        """
+        stat = os.stat(self.path)
+        index = self.index
+        if stat.st_mtime_ns == index.mtime_ns and stat.st_size == index.size:
+            return index
+        with self._lock:
+            if self.index is index:
+                self.index = LineIndex(self.path, self.index_path, self.weighted)
+                self.version += 1
+            return self.index
+
+    def __len__(self):
+        return self.refresh().count
+
+class LineSampler:
+    """
+    セッションごとに会話ラインを抽選するクラス。
+
+    重複なしの場合、重みなしでは鍵付きの擬似ランダムな置換（Feistelネットワーク）で
+    一巡するまで同じ行を選ばず、重み付きでは選んだ行番号を記録して再抽選します。
+    重みなしで保持するのは置換の鍵のみ、重み付きでは抽選済みの数に比例する状態のみです。
+    """
+
+    MAX_ATTEMPTS = 32  # 重み付きで重複を避けるための再抽選の上限
+
+    def __init__(self, corpus, no_repeat=False, rng=None):
+        """
+        LineSamplerのコンストラクタ。
+
+        Args:
+            corpus (LineCorpus): 共有の会話ライン
+            no_repeat (bool, optional): 一巡するまで同じ行を選ばないか
+            rng (random.Random, optional): 乱数生成器。Noneの場合はrandomモジュールを使用
+        """
+        self.corpus = corpus
+        self.no_repeat = no_repeat
+        self.rng = rng or random
+        self.reset()
+
+    def reset(self):
+        """重複なしの抽選状態を初期化します。"""
+        self.version = self.corpus.version
+        self.position = 0  # 一巡の中での抽選回数
+        self.half_bits = 0  # 置換の定義域（2のべき乗）の半分のビット数
+        self.round_keys = []  # Feistelネットワークの各段の鍵
+        self.used = set()  # 重み付きで抽選済みの行番号
+
+    def __len__(self):
+        return len(self.corpus)
+
+    def sample(self):
+        """
+        会話ラインを1つ抽選します。
+
+        Returns:
+            str: 会話ライン
+
+        Raises:
+            ValueError: 会話ラインが空の場合
+        """
+        try:
+            return self.sample_line()
+        except IOError:
+            # 読み込み中にファイルが縮小された場合は、索引を作り直して1回だけ抽選し直す
+            return self.sample_line()
+
+    def sample_line(self):
+        """最新の索引から会話ラインを1つ抽選します（sampleを参照）。"""
+        index = self.corpus.refresh()
+        if not index.count:
+            raise ValueError("会話ラインが空です")
+        if self.version != self.corpus.version:
+            # ファイルが更新された場合は新しい行数で抽選し直す
+            self.reset()
+
+        if not self.no_repeat:
+            return index.get_line(index.sample_number(self.rng))
+        if index.weighted:
+            return index.get_line(self.sample_weighted_unique(index))
+        return index.get_line(self.sample_permuted(index.count))
+
+    def sample_permuted(self, count):
+        """
+        鍵付きの擬似ランダムな置換に従って、一巡するまで重複しない行番号を返します。
+
+        行数以上の2のべき乗を定義域とするFeistelネットワークで抽選回数を置換し、
+        行数以上の値になった場合は行数未満になるまで置換を繰り返します（サイクルウォーキング）。
+        定義域は行数の4倍未満のため、繰り返しは平均数回で終わります。
+
+        Args:
+            count (int): 行数
+
+        Returns:
+            int: 行番号
+        """
+        if self.position % count == 0:
+            # 一巡ごとに鍵を選び直す
+            self.half_bits = max(1, ((count - 1).bit_length() + 1) // 2)
+            self.round_keys = [self.rng.getrandbits(64) for _ in range(FEISTEL_ROUNDS)]
+            self.position = 0
+        number = self.permute(self.position)
+        while number >= count:
+            number = self.permute(number)
+        self.position += 1
+        return number
+
+    def permute(self, value):
+        """
+        Feistelネットワークで定義域内の値を置換します（定義域上の全単射）。
+
+        Args:
+            value (int): 2 ** (2 * half_bits) 未満の値
+
+        Returns:
+            int: 置換後の値
+        """
+        mask = (1 << self.half_bits) - 1
+        left, right = value >> self.half_bits, value & mask
+        for key in self.round_keys:
+            left, right = right, left ^ (self.round_function(right, key) & mask)
+        return (left << self.half_bits) | right
+
+    @staticmethod
+    def round_function(value, key):
+        """Feistelネットワークの段ごとの関数（64ビットの乗算とシフトによる撹拌）"""
+        value = ((value ^ key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        value ^= value >> 32
+        value = (value * 0xD6E8FEB86659FD93) & 0xFFFFFFFFFFFFFFFF
+        return value ^ (value >> 32)
+
+    def sample_weighted_unique(self, index):
+        """
+        重み付きで、抽選済みの行を避けて行番号を返します。
+        再抽選の上限に達した場合は一巡したものとして記録を消去します。
+
+        Args:
+            index (LineIndex): 索引
+
+        Returns:
+            int: 行番号
+        """
+        for _ in range(self.MAX_ATTEMPTS):
+            number = index.sample_number(self.rng)
+            if number not in self.used:
+                break
+        else:
+            self.used.clear()
+        self.used.add(number)
+        return number
+
+_corpora = {}
+_corpora_lock = threading.Lock()
+
+def get_line_corpus(path, weighted=False):
+    """
+    プロセス内で共有するLineCorpusを取得します。
+
+    索引はLINE_INDEX_DIR（未設定の場合はプロジェクトルートの.line_index）に保存します。
+
+    Args:
+        path (str): 会話ラインファイルのパス
+        weighted (bool, optional): 行を重み付きとして扱うか
+
+    Returns:
+        LineCorpus: 共有の会話ライン
+
+    Raises:
+        FileNotFoundError: 会話ラインファイルが存在しない場合
+        IOError: ファイルの読み込みまたは索引の保存に失敗した場合
+    """
+    key = (os.path.abspath(path), weighted)
+    with _corpora_lock:
+        corpus = _corpora.get(key)
+        if corpus is None:
+            # 相対パスはプロジェクトルートからの位置として扱う
+            index_dir = os.path.join(ROOT_DIR, get_setting('LINE_INDEX_DIR', '.line_index'))
+            corpus = LineCorpus(path, index_dir, weighted)
+            _corpora[key] = corpus
+        return corpus
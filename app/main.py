@@ -5,31 +5,305 @@ LLMチャットボットのコアロジックを提供するモジュール。
 
 import requests
 import json
-import random
 import os
+import queue
 import sys
+import threading
+import time
+import uuid
 
 # configモジュールのパスを追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import URL, YOU, BOT, MODEL, CURRENT_MODE, MODES
 from app.paths import get_prompt_path
+from app.settings import get_setting
+from app.profiling import profiled
+from app.hedging import get_hedge_policy
+from app.semantic_cache import get_semantic_cache
+from app.line_corpus import get_line_corpus, LineSampler
+from app.stream_recorder import get_stream_recorder
+from app.single_flight import get_single_flight_group
+from app.generation_options import build_generation_options, estimate_tokens
+from app.request_scheduler import (
+    get_request_scheduler, RequestCancelledError, PRIORITY_INTERACTIVE, PRIORITY_AUTO
+)
+
+# バックエンドのAPI種別
+API_TYPE_GENERATE = 'generate'  # /api/generate（平文プロンプト）
+API_TYPE_CHAT = 'chat'  # /api/chat（構造化メッセージ）
 
 class LLMAPIError(Exception):
     """LLM APIに関連するエラーを表すカスタム例外クラス"""
     pass
 
+def resolve_endpoint_url(mode_config):
+    """
+    モード設定から使用するAPIエンドポイントのURLを決定します。
+
+    モード設定に'url'がある場合はそれを優先し、chatモードでは
+    CHAT_URL（未設定の場合はURLの/api/generateを/api/chatに置き換えたもの）を使用します。
+
+    Args:
+        mode_config (dict): モード設定
+
+    Returns:
+        str: APIエンドポイントのURL
+    """
+    if 'url' in mode_config:
+        return mode_config['url']
+    if mode_config.get('api_type', API_TYPE_GENERATE) == API_TYPE_CHAT:
+        return get_setting('CHAT_URL', URL.replace('/api/generate', '/api/chat'))
+    return URL
+
+def open_stream(url, request_body, session=None):
+    """
+    APIにストリーミングリクエストを送信し、応答オブジェクトを返します。
+
+    Args:
+        url (str): APIエンドポイントのURL
+        request_body (dict): リクエストボディ
+        session (requests.Session, optional): 送信に使用するセッション（省略時は使い捨ての接続）
+
+    Returns:
+        requests.Response: ストリーミング応答
+
+    Raises:
+        LLMAPIError: API通信に失敗した場合
+    """
+    try:
+        response = (session or requests).post(
+            url,
+            json=request_body,
+            stream=True,
+            headers={'Content-Type': 'application/json'},
+            timeout=300  # タイムアウトを設定
+        )
+        response.raise_for_status()  # HTTPエラーをチェック
+        return response
+    except requests.RequestException as error:
+        raise LLMAPIError(f"APIリクエストに失敗しました: {error}")
+
+def iter_stream_records(response):
+    """
+    ストリーミング応答をNDJSONのレコード単位で返します。終了時に応答を閉じます。
+
+    ストリームの記録（STREAM_RECORD_ENABLED）が有効な場合、受信した各行を
+    行間の待ち時間とともにトレースファイルに保存します。
+
+    Args:
+        response (requests.Response): ストリーミング応答
+
+    Yields:
+        dict: NDJSONの1行をパースしたもの
+
+    Raises:
+        LLMAPIError: API通信に失敗した場合
+    """
+    trace = start_stream_trace(response)
+    lines = iter_response_lines(response) if trace is None else iter_recorded_lines(response, trace)
+    try:
+        for line in lines:
+            try:
+                yield json.loads(line.decode('utf-8'))
+            except json.JSONDecodeError:
+                # 不正な行は無視
+                continue
+    except requests.RequestException as error:
+        raise LLMAPIError(f"APIリクエストに失敗しました: {error}")
+    finally:
+        lines.close()
+
+def iter_response_lines(response):
+    """
+    ストリーミング応答の空でない行を返します。終了時に応答を閉じます。
+
+    Args:
+        response (requests.Response): ストリーミング応答
+
+    Yields:
+        bytes: NDJSONの1行（改行を除く）
+    """
+    try:
+        for line in response.iter_lines():
+            if line:
+                yield line
+    finally:
+        response.close()  # ストリームを終了
+
+def iter_recorded_lines(response, trace):
+    """
+    ストリーミング応答を受信用のスレッドで読み込み、到着時刻で記録しながら行を返します。
+
+    呼び出し側の処理（画面の描画や一時停止など）に関係なく到着した時点の待ち時間を記録するため、
+    受信はスレッドで行います。呼び出し側が途中で終了した場合は、次の行の受信時に応答を閉じます
+    （受信中の応答を別スレッドから閉じると読み込みが終わるまで待たされるため）。
+
+    受信スレッドは呼び出し側を待たずに読み進めるため、記録中はスケジューラーによる一時停止の
+    背圧（受信を止めてバックエンドの送信を詰まらせること）が効かず、一時停止中のストリームも
+    最後まで受信してキューに溜めます。一時停止で生成を止める必要がある場合は記録を無効にしてください。
+
+    Args:
+        response (requests.Response): ストリーミング応答
+        trace (StreamTrace): 記録中のトレース
+
+    Yields:
+        bytes: NDJSONの1行（改行を除く）
+
+    Raises:
+        requests.RequestException: 受信に失敗した場合
+    """
+    lines = queue.Queue()
+    stopped = threading.Event()
+
+    def read():
+        """受信した行を記録してキューに積む"""
+        complete = False
+        try:
+            for line in response.iter_lines():
+                if stopped.is_set():
+                    break
+                if line:
+                    trace.add_chunk(line)
+                    lines.put(('line', line))
+            else:
+                complete = True
+            lines.put(('end', None))
+        except Exception as e:
+            lines.put(('error', e))
+        finally:
+            response.close()  # ストリームを終了
+            trace.finish(complete)
+
+    threading.Thread(target=read, daemon=True).start()
+    try:
+        while True:
+            kind, payload = lines.get()
+            if kind == 'line':
+                yield payload
+            elif kind == 'end':
+                return
+            else:
+                raise payload
+    finally:
+        stopped.set()
+
+def start_stream_trace(response):
+    """
+    ストリーミング応答の記録を開始します。
+
+    Args:
+        response (requests.Response): ストリーミング応答
+
+    Returns:
+        Optional[StreamTrace]: 記録中のトレース。記録しない場合はNone。
+    """
+    recorder = get_stream_recorder()
+    if recorder is None:
+        return None
+    try:
+        request_body = json.loads(response.request.body)
+    except (TypeError, ValueError):
+        request_body = None
+    return recorder.start(response.url, request_body, response.elapsed.total_seconds())
+
+def embed_text(text):
+    """
+    バックエンドの埋め込みAPIでテキストを埋め込みベクトルに変換します。
+
+    エンドポイントはEMBED_URL（未設定の場合はURLの/api/generateを/api/embedに置き換えたもの）、
+    モデルはSEMANTIC_CACHE_EMBED_MODELを使用します。
+
+    Args:
+        text (str): 変換するテキスト
+
+    Returns:
+        list: 埋め込みベクトル
+
+    Raises:
+        LLMAPIError: API通信に失敗した場合
+    """
+    try:
+        response = requests.post(
+            get_setting('EMBED_URL', URL.replace('/api/generate', '/api/embed')),
+            json={
+                'model': get_setting('SEMANTIC_CACHE_EMBED_MODEL', 'nomic-embed-text'),
+                'input': text,
+            },
+            headers={'Content-Type': 'application/json'},
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.json()['embeddings'][0]
+    except (requests.RequestException, ValueError, KeyError, IndexError) as error:
+        raise LLMAPIError(f"埋め込みの取得に失敗しました: {error}")
+
+def warm_up_model(mode):
+    """
+    指定されたモードのモデルを事前にロードします（ウォームアップ）。
+
+    トークンを生成しない空のリクエストを送信し、モデルをメモリに常駐させます。
+    モード設定に'keep_alive'がある場合は常駐時間として送信します。
+    生成オプションも送信し、最初のリクエストでnum_ctxの違いによる再ロードが起きないようにします
+    （num_ctxはそのモデルでこれまでに使用した最大の段階、未使用の場合は最小の段階）。
+
+    Args:
+        mode (str): ウォームアップするモード
+
+    Returns:
+        dict: APIからの応答（load_durationなどの計測値を含む）
+
+    Raises:
+        ValueError: 指定されたモードが不正な場合
+        LLMAPIError: API通信に失敗した場合
+    """
+    if mode not in MODES:
+        raise ValueError(f"不正なモード名です: {mode}")
+
+    mode_config = MODES[mode]
+    model = mode_config.get('model', MODEL)
+    request_body = {
+        'model': model,
+        'stream': False,
+    }
+    # 空のプロンプト（メッセージ）はモデルのロードのみを行う
+    if mode_config.get('api_type', API_TYPE_GENERATE) == API_TYPE_CHAT:
+        request_body['messages'] = []
+    else:
+        request_body['prompt'] = ''
+    if 'keep_alive' in mode_config:
+        request_body['keep_alive'] = mode_config['keep_alive']
+    options = build_generation_options(mode_config, backend=(resolve_endpoint_url(mode_config), model))
+    if options:
+        request_body['options'] = options
+
+    try:
+        response = requests.post(
+            resolve_endpoint_url(mode_config),
+            json=request_body,
+            headers={'Content-Type': 'application/json'},
+            timeout=300  # モデルのロード時間を考慮
+        )
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError) as error:
+        raise LLMAPIError(f"ウォームアップに失敗しました: {error}")
+
 class LLMAPI:
     """
     LLMAPIクラスは、会話履歴を管理し、外部APIにリクエストを送信して応答を取得する機能を提供します。
     モードに応じたプロンプトテンプレートと会話ラインを管理し、自動会話機能もサポートします。
     """
 
-    def __init__(self, mode=None):
+    @profiled('LLMAPI.__init__')
+    def __init__(self, mode=None, session_id=None, model=None):
         """
         LLMAPIのコンストラクタ。
 
         Args:
             mode (str, optional): 使用するモード。Noneの場合はCURRENT_MODEを使用。
+            session_id (str, optional): リクエストスケジューラーで使用するセッションID。
+                                        Noneの場合は自動生成。
+            model (str, optional): 使用するモデル。Noneの場合はモード設定またはMODELを使用。
 
         Raises:
             ValueError: 指定されたモードが不正な場合
@@ -37,12 +311,19 @@ class LLMAPI:
         if mode is not None and mode not in MODES:
             raise ValueError(f"不正なモード名です: {mode}")
 
+        self.session_id = session_id or uuid.uuid4().hex
         self.conversation_history = []  # 会話履歴を保持
+        self.chat_messages = []  # chatモード用の役割付き会話履歴
         self.initial_prompt_sent = False  # 初回プロンプト送信フラグ
         self.current_mode = mode if mode is not None else CURRENT_MODE
         self.current_mode_config = MODES[self.current_mode]  # 現在のモード設定
+        self.api_type = self.current_mode_config.get('api_type', API_TYPE_GENERATE)
+        self.model = model or self.current_mode_config.get('model', MODEL)  # 使用するモデル
+        self.last_stats = {}  # 直近のストリーム最終レコードの計測値
+        if self.api_type not in (API_TYPE_GENERATE, API_TYPE_CHAT):
+            raise ValueError(f"不正なAPI種別です: {self.api_type}")
         self.prompt_template = self.load_prompt_template()  # プロンプトテンプレートを読み込む
-        self.default_you_lines = self.load_default_you_lines()  # デフォルトの会話ラインを読み込む
+        self.default_you_lines = self.load_default_you_lines()  # デフォルトの会話ラインの抽選器
 
     def load_prompt_template(self):
         """
@@ -66,10 +347,14 @@ class LLMAPI:
 
     def load_default_you_lines(self):
         """
-        現在のモードに応じたデフォルトの会話ラインをファイルから読み込みます。
+        現在のモードに応じたデフォルトの会話ラインを開き、このセッション用の抽選器を返します。
+
+        会話ラインファイルはプロセス内で共有され、索引を使って必要な行だけを読み込みます。
+        モード設定の'you_lines_weighted'がTrueの場合は各行を「重み<TAB>テキスト」として扱い、
+        'you_lines_no_repeat'がTrueの場合は一巡するまで同じ行を選びません。
 
         Returns:
-            list: デフォルトの会話ラインのリスト
+            LineSampler: デフォルトの会話ラインの抽選器
 
         Raises:
             FileNotFoundError: 会話ラインファイルが存在しない場合
@@ -77,32 +362,123 @@ class LLMAPI:
         """
         lines_path = get_prompt_path(self.current_mode, 'default_you_lines.txt')
         try:
-            with open(lines_path, 'r', encoding='utf-8') as file:
-                return [line.strip() for line in file.readlines() if line.strip()]
+            corpus = get_line_corpus(
+                lines_path,
+                weighted=self.current_mode_config.get('you_lines_weighted', False)
+            )
         except FileNotFoundError:
             raise FileNotFoundError(f"会話ラインファイルが見つかりません: {lines_path}")
         except IOError as e:
             raise IOError(f"会話ラインファイルの読み込みに失敗しました: {e}")
+        return LineSampler(corpus, no_repeat=self.current_mode_config.get('you_lines_no_repeat', False))
 
-    def request(self, user_input):
+    def get_endpoint_url(self):
         """
-        ユーザー入力を基に外部APIにリクエストを送信し、応答を取得します。
+        現在のモードで使用するAPIエンドポイントのURLを取得します。
+
+        Returns:
+            str: APIエンドポイントのURL
+        """
+        return resolve_endpoint_url(self.current_mode_config)
+
+    def split_prompt_template(self):
+        """
+        プロンプトテンプレートを{history}の前後で分割します。
+
+        Returns:
+            tuple: (履歴より前の部分, 履歴より後の部分)。{bot_name}は置換済み。
+                   {history}を含まない場合はテンプレート全体と空文字列。
+        """
+        if '{history}' not in self.prompt_template:
+            return self.prompt_template.format(bot_name=BOT), ''
+        prefix, suffix = self.prompt_template.split('{history}', 1)
+        return prefix.format(bot_name=BOT), suffix.format(bot_name=BOT)
+
+    def append_history(self, role, content):
+        """
+        会話履歴に発言を追加します。
+
+        平文の会話履歴とchatモード用の役割付き履歴の両方を更新します。
 
         Args:
-            user_input (str): ユーザーの入力
+            role (str): 'user' または 'assistant'
+            content (str): 発言内容
+        """
+        speaker = YOU if role == 'user' else BOT
+        self.conversation_history.append(f"{speaker}: {content}")
+        self.chat_messages.append({'role': role, 'content': content})
+
+    def truncate_history(self, length):
+        """
+        会話履歴を指定した件数まで切り詰めます。
+
+        Args:
+            length (int): 残す発言の件数
+        """
+        del self.conversation_history[length:]
+        del self.chat_messages[length:]
+
+    def build_request_body(self):
+        """
+        現在の会話履歴からAPIのリクエストボディを組み立てます。
 
         Returns:
-            dict: APIからの応答オブジェクト
+            dict: リクエストボディ
+        """
+        if self.api_type == API_TYPE_CHAT:
+            # テンプレートの固定部分をsystemメッセージとし、履歴は役割付きで送信
+            system_prompt, _ = self.split_prompt_template()
+            messages = [{'role': 'system', 'content': system_prompt.strip()}]
+            messages.extend(self.chat_messages)
+            request_body = {
+                'model': self.model,
+                'messages': messages,
+                'stream': True,  # ストリーミングを有効化
+            }
+        else:
+            request_body = {
+                'model': self.model,
+                'prompt': self.build_prompt(),
+                'stream': True,  # ストリーミングを有効化
+            }
+
+        # モデルの常駐時間をモードごとに指定
+        if 'keep_alive' in self.current_mode_config:
+            request_body['keep_alive'] = self.current_mode_config['keep_alive']
+
+        # モードごとの生成オプション（num_ctxはプロンプト長に応じて段階的に拡大し、モデルごとに縮小しない）
+        options = build_generation_options(
+            self.current_mode_config,
+            self.estimate_prompt_tokens(request_body),
+            backend=(self.get_endpoint_url(), self.model)
+        )
+        if options:
+            request_body['options'] = options
+        return request_body
+
+    def estimate_prompt_tokens(self, request_body):
+        """
+        リクエストボディのプロンプトの推定トークン数を計算します。
 
-        Raises:
-            LLMAPIError: API通信に失敗した場合
+        Args:
+            request_body (dict): リクエストボディ
+
+        Returns:
+            int: 推定トークン数
         """
-        if not isinstance(user_input, str):
-            raise ValueError("user_inputは文字列である必要があります")
+        if 'messages' in request_body:
+            text = "\n".join(message['content'] for message in request_body['messages'])
+        else:
+            text = request_body.get('prompt', '')
+        return estimate_tokens(text)
 
-        # 会話履歴に現在の入力を追加
-        if user_input:
-            self.conversation_history.append(f"{YOU}: {user_input}")
+    def build_prompt(self):
+        """
+        generateモード用の平文プロンプトを組み立てます。
+
+        Returns:
+            str: プロンプト
+        """
 
         # 履歴をまとめてプロンプトに追加
         prompt_history = "\n".join(self.conversation_history)
@@ -116,58 +492,252 @@ class LLMAPI:
             self.initial_prompt_sent = True
         else:
             prompt = prompt_history + f"\n{BOT}:"
+        return prompt
+
+    def extract_response_text(self, record):
+        """
+        ストリームの1レコードから応答テキストを取り出します。
+
+        Args:
+            record (dict): NDJSONの1行をパースしたもの
+
+        Returns:
+            str: 応答テキスト（含まれない場合は空文字列）
+        """
+        if self.api_type == API_TYPE_CHAT:
+            return (record.get('message') or {}).get('content', '')
+        return record.get('response', '')
+
+    def iter_response_records(self, url, request_body):
+        """
+        APIにリクエストを送信し、ストリーミング応答をレコード単位で返します。
+
+        Args:
+            url (str): APIエンドポイントのURL
+            request_body (dict): リクエストボディ
+
+        Yields:
+            dict: NDJSONの1行をパースしたもの
+
+        Raises:
+            LLMAPIError: API通信に失敗した場合
+        """
+        response = open_stream(url, request_body)
+        yield from iter_stream_records(response)
+
+    def iter_scheduled_records(self, urls, request_body, priority):
+        """
+        リクエストスケジューラーの実行枠を取得してからバックエンドに送信し、応答をレコード単位で返します。
+
+        ヘッジが有効で送信先が複数ある場合、最初のトークンが遅いときは同じリクエストを
+        予備のバックエンドにも送信し、先に応答した方を採用します。予備のバックエンドへの送信は、
+        そのバックエンドの実行枠を待たずに取得できた場合のみ行います。
+
+        Args:
+            urls (list): 送信先URLの一覧（先頭が主バックエンド）
+            request_body (dict): リクエストボディ
+            priority (str): 優先度クラス
+
+        Yields:
+            dict: NDJSONの1行をパースしたもの
+
+        Raises:
+            LLMAPIError: API通信に失敗した場合
+            RequestCancelledError: スケジューラーにキャンセルされた場合
+        """
+        scheduler = get_request_scheduler()
+        hedge_policy = get_hedge_policy()
+
+        def acquire(url):
+            return scheduler.try_acquire(priority, self.session_id, url)
+
+        with scheduler.slot(priority, self.session_id, urls[0]) as ticket:
+            if not hedge_policy.enabled or len(urls) < 2:
+                records = self.iter_response_records(urls[0], request_body)
+            else:
+                records = hedge_policy.iter_records(
+                    urls, request_body, open_stream, iter_stream_records, acquire_func=acquire
+                )
+            try:
+                for record in records:
+                    # 一時停止中は再開まで待機し、キャンセルされた場合は中断
+                    ticket.checkpoint()
+                    yield record
+            finally:
+                records.close()
+
+    def iter_backend_records(self, request_body, priority=PRIORITY_INTERACTIVE):
+        """
+        現在のモードのバックエンドにリクエストを送信し、応答をレコード単位で返します
+        （送信はiter_scheduled_recordsを参照）。
+
+        シングルフライト（SINGLE_FLIGHT_ENABLED）が有効な場合、同一内容・同一優先度の実行中リクエストが
+        あればそのストリームを共有します。スケジューラーの実行枠は最初に送信したリクエストだけが取得し、
+        共有する側は実行枠を待たずに購読します。
+
+        Args:
+            request_body (dict): リクエストボディ
+            priority (str, optional): 優先度クラス
+
+        Yields:
+            dict: NDJSONの1行をパースしたもの
+
+        Raises:
+            LLMAPIError: API通信に失敗した場合
+            RequestCancelledError: スケジューラーにキャンセルされた場合
+        """
+        urls = [self.get_endpoint_url()] + list(self.current_mode_config.get('hedge_urls', []))
 
-        # リクエストボディ
-        request_body = {
-            'model': MODEL,
-            'prompt': prompt,
-            'stream': True,  # ストリーミングを有効化
-        }
+        def start():
+            return self.iter_scheduled_records(urls, request_body, priority)
+
+        single_flight = get_single_flight_group()
+        if single_flight is None:
+            return start()
+        return single_flight.iter_records(single_flight.make_key(urls, request_body, priority), start)
+
+    def request_stream(self, user_input, priority=PRIORITY_INTERACTIVE):
+        """
+        ユーザー入力を基に外部APIにリクエストを送信し、応答をストリーミングで返します。
+
+        リクエストはリクエストスケジューラーの実行枠を取得してから送信されます。
+        応答終了マーカーを受信するか、ストリームが終了した時点でストリームを閉じ、応答を会話履歴に追加します。
+        マーカーを受信せずにストリームが終了した場合のみ、最終レコードの計測値をlast_statsに保持します。
+        途中で反復を打ち切った場合やエラーで中断した場合は、送信したユーザー入力も含めて
+        会話履歴を送信前の状態に戻します。
+
+        Args:
+            user_input (str): ユーザーの入力
+            priority (str, optional): 優先度クラス（'interactive', 'auto', 'batch'）
+
+        Yields:
+            str: 受信した応答テキストの断片
+
+        Raises:
+            LLMAPIError: API通信に失敗した場合、またはスケジューラーにキャンセルされた場合
+        """
+        if not isinstance(user_input, str):
+            raise ValueError("user_inputは文字列である必要があります")
+
+        # 中断時に履歴を元に戻すための状態
+        history_length = len(self.chat_messages)
+        initial_prompt_sent = self.initial_prompt_sent
+        completed = False
 
         try:
-            response = requests.post(
-                URL, 
-                json=request_body, 
-                stream=True, 
-                headers={'Content-Type': 'application/json'},
-                timeout=300  # タイムアウトを設定
+            yield from self.stream_turn(user_input, priority)
+            completed = True
+        finally:
+            if not completed:
+                self.truncate_history(history_length)
+                self.initial_prompt_sent = initial_prompt_sent
+
+    def stream_turn(self, user_input, priority):
+        """
+        1往復分の送受信を行い、応答を会話履歴に追加します（request_streamを参照）。
+
+        中断時の履歴の巻き戻しは呼び出し側（request_stream）で行います。
+
+        Args:
+            user_input (str): ユーザーの入力
+            priority (str): 優先度クラス
+
+        Yields:
+            str: 受信した応答テキストの断片
+
+        Raises:
+            LLMAPIError: API通信に失敗した場合、またはスケジューラーにキャンセルされた場合
+        """
+        # 会話履歴に現在の入力を追加
+        if user_input:
+            self.append_history('user', user_input)
+
+        # 意味的に近い過去の入力があればキャッシュした応答を返す
+        semantic_cache = get_semantic_cache(embed_text) if user_input else None
+        if semantic_cache is not None:
+            cache_scope = semantic_cache.make_scope(
+                self.current_mode, self.chat_messages[:-1], model=self.model, template=self.prompt_template
             )
-            response.raise_for_status()  # HTTPエラーをチェック
-
-            full_response = ''
-            response_received = False
-
-            for chunk in response.iter_content(chunk_size=None):
-                chunk_str = chunk.decode('utf-8')
-
-                # 各チャンクごとに JSON をパース
-                try:
-                    json_chunk = json.loads(chunk_str)
-                    response_text = json_chunk.get('response', '')
-
-                    # レスポンスを蓄積
-                    if response_text:
-                        full_response += response_text
-
-                    # 応答終了マーカーが含まれたら終了
-                    if response_text and self.current_mode_config['response_end_marker'] in response_text:
-                        response_received = True
-                        response.close()  # ストリームを終了
-                        response_obj = {'response': full_response.strip()}  # オブジェクト形式で返却
-                        self.conversation_history.append(f"{BOT}: {response_obj['response']}")  # 履歴に追加
-                        return response_obj  # オブジェクトを返す
-                except json.JSONDecodeError:
-                    # 部分的な JSON チャンクの場合は無視
+            cached_answer, cache_vector = semantic_cache.lookup(cache_scope, user_input)
+            if cached_answer is not None:
+                yield cached_answer
+                self.append_history('assistant', cached_answer)
+                return
+
+        started_at = time.perf_counter()
+        request_body = self.build_request_body()
+        end_marker = self.current_mode_config['response_end_marker']
+        full_response = ''
+        self.last_stats = {}
+
+        records = self.iter_backend_records(request_body, priority)
+        try:
+            for record in records:
+                # ストリームが自然に終了した場合は最終レコードの計測値（load_duration, eval_countなど）を保持
+                if record.get('done'):
+                    self.last_stats = {
+                        key: value for key, value in record.items()
+                        if key.endswith('_duration') or key.endswith('_count')
+                    }
+                    break
+
+                response_text = self.extract_response_text(record)
+                if not response_text:
                     continue
 
-            # 最後まで到達した場合の処理
-            if not response_received:
-                response_obj = {'response': full_response.strip() or '予期しない形式の返答が返されました。'}
-                self.conversation_history.append(f"{BOT}: {response_obj['response']}")
-                return response_obj
+                # レスポンスを蓄積
+                full_response += response_text
+                yield response_text
+
+                # 応答終了マーカーが含まれたら終了
+                if end_marker in response_text:
+                    break
+        except RequestCancelledError as e:
+            raise LLMAPIError(f"リクエストがキャンセルされました: {e}")
+        finally:
+            records.close()  # 残りの生成を待たずにストリームを閉じる
+
+        self.append_history(
+            'assistant',
+            full_response.strip() or '予期しない形式の返答が返されました。'
+        )
+
+        if semantic_cache is not None and cache_vector is not None and full_response.strip():
+            semantic_cache.store(
+                cache_scope, cache_vector, user_input, full_response.strip(),
+                time.perf_counter() - started_at
+            )
+
+    @profiled('LLMAPI.request')
+    def request(self, user_input, priority=PRIORITY_INTERACTIVE):
+        """
+        ユーザー入力を基に外部APIにリクエストを送信し、応答を取得します。
+
+        Args:
+            user_input (str): ユーザーの入力
+            priority (str, optional): 優先度クラス（'interactive', 'auto', 'batch'）
 
-        except requests.RequestException as error:
-            raise LLMAPIError(f"APIリクエストに失敗しました: {error}")
+        Returns:
+            dict: APIからの応答オブジェクト
+
+        Raises:
+            LLMAPIError: API通信に失敗した場合
+        """
+        for _ in self.request_stream(user_input, priority):
+            pass
+        return {'response': self.chat_messages[-1]['content']}
+
+    def warm_up(self):
+        """
+        現在のモードのモデルをウォームアップします。
+
+        Returns:
+            dict: APIからの応答（load_durationなどの計測値を含む）
+
+        Raises:
+            LLMAPIError: API通信に失敗した場合
+        """
+        return warm_up_model(self.current_mode)
 
     def generate_next_message(self):
         """
@@ -181,10 +751,7 @@ class LLMAPI:
         Raises:
             ValueError: 会話ラインが空の場合
         """
-        if not self.default_you_lines:
-            raise ValueError("会話ラインが空です")
-
-        base_line = random.choice(self.default_you_lines)
+        base_line = self.default_you_lines.sample()
         
         # モードの設定で生成方法が定義されている場合はその方法を使用
         if 'message_generator' in self.current_mode_config:
@@ -209,9 +776,9 @@ class LLMAPI:
         if use_history:
             next_message = self.generate_next_message()
         else:
-            next_message = random.choice(self.default_you_lines)
+            next_message = self.default_you_lines.sample()
 
-        return self.request(next_message)
+        return self.request(next_message, priority=PRIORITY_AUTO)
 
 def main():
     """
@@ -219,6 +786,10 @@ def main():
     """
     try:
         llm = LLMAPI()
+        try:
+            llm.warm_up()  # 初回応答の待ち時間にモデルのロード時間が含まれないようにする
+        except LLMAPIError as e:
+            print(f"ウォームアップに失敗しました: {e}")
         print(f'{BOT}と会話を始めましょう！（終了するには "exit" と入力してください）')
 
         while True:
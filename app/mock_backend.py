@@ -0,0 +1,182 @@
+"""
+ローカル検証用のスタンドインバックエンドを提供するモジュール。
+Ollama互換の/api/generate、/api/chat、/api/embedを模擬し、GPUなしでエンドツーエンドの動作確認を行えるようにします。
+
+使用例:
+    python -m app.mock_backend --port 11435 --delay 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockBackendHandler(BaseHTTPRequestHandler):
+    """Ollama互換APIを模擬するリクエストハンドラー"""
+
+    # Ollamaと同様にチャンク転送でレコードを1つずつ送る
+    protocol_version = 'HTTP/1.1'
+
+    # サーバー側で設定する値
+    reply_text = '「こんにちは！今日はいい天気ですね。」'
+    chunk_size = 4  # 1レコードあたりの文字数
+    delay = 0.0  # レコード間の待ち時間（秒）
+
+    def log_message(self, format, *args):
+        """アクセスログを出力しない"""
+        pass
+
+    def read_json_body(self):
+        """
+        リクエストボディをJSONとして読み込みます。
+
+        Returns:
+            dict: リクエストボディ（不正な場合は空の辞書）
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            return {}
+
+    def send_json(self, status, body):
+        """JSON応答を送信"""
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, record):
+        """NDJSONの1行をチャンクとして送信"""
+        self.write_raw_chunk((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    def write_raw_chunk(self, data):
+        """バイト列をそのままチャンクとして送信"""
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    @staticmethod
+    def embed(text, dimensions=256):
+        """
+        文字バイグラムのハッシュによる簡易的な埋め込みベクトルを生成します。
+        似た文字列ほど類似度が高くなります。
+        """
+        vector = [0.0] * dimensions
+        for i in range(max(1, len(text) - 1)):
+            digest = hashlib.md5(text[i:i + 2].encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % dimensions] += 1.0
+        return vector
+
+    def do_POST(self):
+        """リクエストボディを読み込み、handle_postで処理"""
+        self.handle_post(self.read_json_body())
+
+    def handle_post(self, body):
+        """
+        /api/generate、/api/chat、/api/embed を処理
+
+        Args:
+            body (dict): リクエストボディ
+        """
+        if self.path == '/api/embed':
+            inputs = body.get('input', '')
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            self.send_json(200, {'model': body.get('model'), 'embeddings': [self.embed(text) for text in inputs]})
+            return
+
+        if self.path not in ('/api/generate', '/api/chat'):
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        is_chat = self.path == '/api/chat'
+
+        # 空のプロンプトはモデルのロードのみ（ウォームアップ）
+        if body.get('stream') is False or (not body.get('prompt') and not body.get('messages')):
+            self.send_json(200, {'model': body.get('model'), 'done': True, 'load_duration': 0})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        started_at = time.perf_counter_ns()
+        text = self.reply_text
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        try:
+            for chunk in chunks:
+                if self.delay:
+                    time.sleep(self.delay)
+                if is_chat:
+                    record = {'message': {'role': 'assistant', 'content': chunk}, 'done': False}
+                else:
+                    record = {'response': chunk, 'done': False}
+                self.write_chunk(record)
+
+            final_record = {
+                'done': True,
+                'load_duration': 0,
+                'prompt_eval_count': len(body.get('prompt', '')),  # 文字数を擬似的なトークン数とする
+                'eval_count': len(chunks),
+                'eval_duration': time.perf_counter_ns() - started_at,
+            }
+            self.write_chunk(final_record)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で切断した場合
+            pass
+
+def create_mock_backend(host='127.0.0.1', port=0, delay=0.0, reply_text=None):
+    """
+    スタンドインバックエンドのサーバーを生成します（起動はしません）。
+
+    Args:
+        host (str, optional): 待ち受けホスト
+        port (int, optional): 待ち受けポート（0の場合は空きポート）
+        delay (float, optional): レコード間の待ち時間（秒）
+        reply_text (str, optional): 返す応答テキスト
+
+    Returns:
+        ThreadingHTTPServer: 生成したサーバー（server_addressで実際のポートを取得可能）
+    """
+    handler = type('ConfiguredMockBackendHandler', (MockBackendHandler,), {
+        'delay': delay,
+        'reply_text': reply_text or MockBackendHandler.reply_text,
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+def start_mock_backend(**kwargs):
+    """
+    スタンドインバックエンドをバックグラウンドスレッドで起動します。
+
+    Args:
+        **kwargs: create_mock_backendに渡す引数
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー
+    """
+    server = create_mock_backend(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    """コマンドラインからスタンドインバックエンドを起動します。"""
+    parser = argparse.ArgumentParser(description='Ollama互換のスタンドインバックエンド')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--delay', type=float, default=0.0, help='レコード間の待ち時間（秒）')
+    args = parser.parse_args()
+
+    server = create_mock_backend(args.host, args.port, args.delay)
+    print(f'スタンドインバックエンドを起動しました: http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+複数のモード・モデルの応答を並べて比較するページ
+"""
+import streamlit as st
+from config import MODEL, MODES
+from app.comparison import ComparisonSession, EVENT_CHUNK, EVENT_DONE
+
+# 比較できる構成数の上限
+MAX_COLUMNS = 4
+
+# ページ設定
+st.set_page_config(
+    page_title="応答比較",
+    page_icon="🆚",
+    layout="wide",
+    menu_items={
+        'Get Help': None,
+        'Report a bug': None,
+        'About': "複数のモード・モデルの応答比較"
+    }
+)
+
+# ページタイトルの設定
+st.markdown("""
+# 応答比較
+同じ入力を複数のモード・モデルに同時に送信し、応答を並べて比較します。
+""")
+
+def format_stats(stats):
+    """
+    列ごとの計測値を表示用の文字列に変換します。
+
+    Args:
+        stats (dict): TTFT、生成速度、所要時間
+
+    Returns:
+        str: 表示用の文字列
+    """
+    ttft = f"{stats['ttft']:.2f}秒" if stats.get('ttft') is not None else "-"
+    speed = f"{stats['tokens_per_second']:.1f} tok/s" if stats.get('tokens_per_second') else "-"
+    return f"TTFT {ttft} ・ {speed} ・ 全体 {stats['elapsed']:.2f}秒"
+
+def render_target_selector():
+    """
+    比較する構成の選択UIをサイドバーに描画します。
+    構成を適用すると比較セッションと履歴を作り直します。
+    """
+    modes = list(MODES.keys())
+    column_count = st.number_input("比較する構成数", min_value=1, max_value=MAX_COLUMNS, value=2)
+
+    targets = []
+    for i in range(column_count):
+        st.markdown(f"#### 構成 {i + 1}")
+        mode = st.selectbox(
+            "モード",
+            modes,
+            format_func=lambda x: MODES[x]['display_name'],
+            key=f"comparison_mode_{i}"
+        )
+        model = st.text_input(
+            "モデル",
+            value=MODES[mode].get('model', MODEL),
+            key=f"comparison_model_{i}_{mode}"
+        )
+        targets.append((mode, model.strip() or None))
+
+    if st.button("構成を適用") or 'comparison_session' not in st.session_state:
+        try:
+            st.session_state.comparison_session = ComparisonSession(targets)
+            st.session_state.comparison_turns = []
+        except Exception as e:
+            st.error(f"構成エラー: {e}")
+
+def render_turn(columns, turn):
+    """
+    過去の1往復を列ごとに描画します。
+
+    Args:
+        columns (list): Streamlitの列
+        turn (dict): {'user', 'responses', 'stats'}
+    """
+    for column, response, stats in zip(columns, turn['responses'], turn['stats']):
+        with column:
+            with st.chat_message("user"):
+                st.write(turn['user'])
+            with st.chat_message("assistant"):
+                st.write(response)
+                if stats:
+                    st.caption(format_stats(stats))
+
+def run_comparison(columns, session, message):
+    """
+    入力を全ての構成に同時に送信し、応答を列ごとにストリーミング表示します。
+
+    Args:
+        columns (list): Streamlitの列
+        session (ComparisonSession): 比較セッション
+        message (str): ユーザーの入力
+
+    Returns:
+        dict: 描画した1往復（{'user', 'responses', 'stats'}）
+    """
+    turn = {
+        'user': message,
+        'responses': [''] * len(session.columns),
+        'stats': [None] * len(session.columns),
+    }
+    placeholders = []
+    for column in columns:
+        with column:
+            with st.chat_message("user"):
+                st.write(message)
+            with st.chat_message("assistant"):
+                text_placeholder = st.empty()
+                text_placeholder.write("考え中...")
+                placeholders.append((text_placeholder, st.empty()))
+
+    for index, kind, payload in session.iter_events(message):
+        text_placeholder, stats_placeholder = placeholders[index]
+        if kind == EVENT_CHUNK:
+            turn['responses'][index] += payload
+            text_placeholder.write(turn['responses'][index])
+        elif kind == EVENT_DONE:
+            turn['stats'][index] = payload
+            stats_placeholder.caption(format_stats(payload))
+        else:
+            turn['responses'][index] = f"APIエラー: {payload}"
+            text_placeholder.error(payload)
+    return turn
+
+def main():
+    """
+    応答比較ページのメイン処理
+    """
+    with st.sidebar:
+        st.markdown("### 比較する構成")
+        render_target_selector()
+
+    session = st.session_state.get('comparison_session')
+    if session is None:
+        return
+
+    columns = st.columns(len(session.columns))
+    for column, comparison_column in zip(columns, session.columns):
+        column.markdown(f"**{comparison_column.label}**")
+    for turn in st.session_state.comparison_turns:
+        render_turn(columns, turn)
+
+    if message := st.chat_input("比較するメッセージを入力"):
+        st.session_state.comparison_turns.append(run_comparison(columns, session, message))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+オプトインのプロファイリング機能を提供するモジュール。
+名前付きの計測区間（スパン）の所要時間を集計し、Streamlitの再実行ごとのCPUプロファイルを
+サンプリングしてファイルに保存します。
+
+環境変数LLM_CHAT_PROFILE=1、またはconfigのPROFILING_ENABLED = Trueで有効になります。
+無効時はデコレータが元の関数をそのまま返すため、オーバーヘッドはほぼありません。
+"""
+
+import cProfile
+import functools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from app.paths import ROOT_DIR
+from app.settings import get_setting
+
+def _is_enabled():
+    """環境変数または設定からプロファイリングの有効・無効を判定"""
+    env_value = os.environ.get('LLM_CHAT_PROFILE', '').lower()
+    if env_value:
+        return env_value in ('1', 'true', 'yes', 'on')
+    return bool(get_setting('PROFILING_ENABLED', False))
+
+# インポート時に一度だけ判定する
+ENABLED = _is_enabled()
+
+# cProfileはプロセス内で同時に1つしか有効にできない（Python 3.12以降は2つ目がValueError）ため、
+# 再実行ごとのスレッドで取得が重なった場合は後から来た方のサンプリングを見送る
+_cpu_profile_lock = threading.Lock()
+
+class SpanRecorder:
+    """スパン名ごとの所要時間を集計するクラス"""
+
+    def __init__(self):
+        self.spans = {}  # スパン名 -> {'count', 'total', 'max', 'last'}
+        self._lock = threading.Lock()
+
+    def record(self, name, duration):
+        """
+        スパンの所要時間を記録します。
+
+        Args:
+            name (str): スパン名
+            duration (float): 所要時間（秒）
+        """
+        with self._lock:
+            stats = self.spans.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['max'] = max(stats['max'], duration)
+            stats['last'] = duration
+
+    def get_slowest(self, limit=10):
+        """
+        最大所要時間の長い順にスパンの集計を取得します。
+
+        Args:
+            limit (int, optional): 取得する件数
+
+        Returns:
+            list: {'name', 'count', 'avg', 'max', 'last'}のリスト
+        """
+        with self._lock:
+            rows = [
+                {
+                    'name': name,
+                    'count': stats['count'],
+                    'avg': stats['total'] / stats['count'],
+                    'max': stats['max'],
+                    'last': stats['last'],
+                }
+                for name, stats in self.spans.items()
+            ]
+        return sorted(rows, key=lambda row: row['max'], reverse=True)[:limit]
+
+    def clear(self):
+        """集計をリセット"""
+        with self._lock:
+            self.spans.clear()
+
+recorder = SpanRecorder()
+
+@contextmanager
+def _timed_span(name):
+    """所要時間を計測して記録するコンテキスト"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(name, time.perf_counter() - started_at)
+
+def profiled(name):
+    """
+    関数の所要時間をスパンとして計測するデコレータ。
+    無効時は元の関数をそのまま返します。
+
+    Args:
+        name (str): スパン名
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _timed_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def sampled_cpu_profile(label):
+    """
+    PROFILING_SAMPLE_RATEの確率でCPUプロファイルを取得し、PROFILING_DIRに保存します。
+
+    保存したファイルは python -m pstats <ファイル> や snakeviz で参照できます。
+
+    Args:
+        label (str): ファイル名に含めるラベル
+    """
+    if not ENABLED or random.random() >= get_setting('PROFILING_SAMPLE_RATE', 0.0):
+        yield
+        return
+
+    # 他の再実行がプロファイル取得中ならサンプリングしない
+    if not _cpu_profile_lock.acquire(blocking=False):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # ロック外で別のプロファイラが動いている場合もページを壊さない
+        _cpu_profile_lock.release()
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _cpu_profile_lock.release()
+        # 相対パスはプロジェクトルートからの位置として扱う
+        profile_dir = os.path.join(ROOT_DIR, get_setting('PROFILING_DIR', '.profiles'))
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            profiler.dump_stats(os.path.join(profile_dir, f"{timestamp}_{label}.prof"))
+        except OSError as e:
+            print(f"プロファイルの保存に失敗しました: {e}")
@@ -0,0 +1,183 @@
+"""
+記録したトレースを再生するバックエンドを提供するモジュール。
+app.stream_recorderで保存した応答を、記録時の行間の待ち時間どおり（または指定倍速、最大速度）で返し、
+GPUなしで実際の応答の形に対するクライアント側の性能を計測できるようにします。
+
+リクエストボディが記録と完全に一致するトレースがあればそれを、なければ記録順に巡回して再生します。
+途中で中断されたトレース（completeがFalse）は最終レコードを含まないため、既定では再生しません。
+ウォームアップと埋め込みはスタンドインバックエンドと同様に応答します。
+
+使用例:
+    python -m app.replay_backend .traces --port 11435 --speed 2
+    （--speed 0 で待ち時間なしの最大速度）
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse
+from app.mock_backend import MockBackendHandler
+from app.stream_recorder import load_traces
+
+class TraceLibrary:
+    """トレースをリクエストに対応付けるクラス"""
+
+    def __init__(self, traces, include_incomplete=False):
+        """
+        TraceLibraryのコンストラクタ。
+
+        Args:
+            traces (list): トレースの一覧
+            include_incomplete (bool, optional): 途中で中断されたトレースも再生対象にするか
+        """
+        skipped = 0
+        if not include_incomplete:
+            complete_traces = [trace for trace in traces if trace.get('complete')]
+            skipped = len(traces) - len(complete_traces)
+            traces = complete_traces
+        self.exact = {}  # (パス, リクエストボディ) -> トレース
+        self.by_path = {}  # パス -> トレースの一覧
+        for trace in traces:
+            path = urlparse(trace.get('url') or '').path
+            self.exact.setdefault((path, self.make_key(trace.get('request'))), trace)
+            self.by_path.setdefault(path, []).append(trace)
+        self.traces = list(traces)
+        self.positions = {}  # パス -> 次に巡回再生する位置
+        self.stats = {'exact': 0, 'sequential': 0, 'skipped_incomplete': skipped}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(request_body):
+        """リクエストボディを比較用の文字列に変換"""
+        return json.dumps(request_body, ensure_ascii=False, sort_keys=True)
+
+    def find(self, path, request_body):
+        """
+        リクエストに対応するトレースを取得します。
+
+        Args:
+            path (str): リクエストのパス
+            request_body (dict): リクエストボディ
+
+        Returns:
+            Optional[dict]: トレース。トレースが1件もない場合はNone。
+        """
+        with self._lock:
+            trace = self.exact.get((path, self.make_key(request_body)))
+            if trace is not None:
+                self.stats['exact'] += 1
+                return trace
+
+            candidates = self.by_path.get(path) or self.traces
+            if not candidates:
+                return None
+            position = self.positions.get(path, 0)
+            self.positions[path] = (position + 1) % len(candidates)
+            self.stats['sequential'] += 1
+            return candidates[position]
+
+class ReplayBackendHandler(MockBackendHandler):
+    """トレースを再生するリクエストハンドラー"""
+
+    # サーバー側で設定する値
+    library = TraceLibrary([])
+    speed = 1.0  # 再生速度の倍率（0の場合は待ち時間なし）
+
+    def wait(self, delay):
+        """記録時の待ち時間を再生速度に応じて待つ"""
+        if self.speed > 0 and delay > 0:
+            time.sleep(delay / self.speed)
+
+    def handle_post(self, body):
+        """
+        ストリーミングの生成リクエストにはトレースを再生し、それ以外はスタンドインとして応答します。
+
+        Args:
+            body (dict): リクエストボディ
+        """
+        is_generation = self.path in ('/api/generate', '/api/chat')
+        is_warm_up = not body.get('prompt') and not body.get('messages')
+        if not is_generation or is_warm_up or body.get('stream') is False:
+            super().handle_post(body)
+            return
+
+        trace = self.library.find(self.path, body)
+        if trace is None:
+            self.send_json(404, {'error': 'no trace recorded'})
+            return
+
+        self.wait(trace.get('header_delay', 0.0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for delay, line in trace['chunks']:
+                self.wait(delay)
+                self.write_raw_chunk((line + '\n').encode('utf-8'))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で切断した場合
+            pass
+
+def create_replay_backend(traces, host='127.0.0.1', port=0, speed=1.0, include_incomplete=False):
+    """
+    トレースを再生するバックエンドのサーバーを生成します（起動はしません）。
+
+    Args:
+        traces (list): トレースの一覧
+        host (str, optional): 待ち受けホスト
+        port (int, optional): 待ち受けポート（0の場合は空きポート）
+        speed (float, optional): 再生速度の倍率（0の場合は待ち時間なし）
+        include_incomplete (bool, optional): 途中で中断されたトレースも再生対象にするか
+
+    Returns:
+        ThreadingHTTPServer: 生成したサーバー（RequestHandlerClass.library.statsで一致状況を取得可能）
+    """
+    handler = type('ConfiguredReplayBackendHandler', (ReplayBackendHandler,), {
+        'library': TraceLibrary(traces, include_incomplete),
+        'speed': speed,
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+def start_replay_backend(traces, **kwargs):
+    """
+    トレースを再生するバックエンドをバックグラウンドスレッドで起動します。
+
+    Args:
+        traces (list): トレースの一覧
+        **kwargs: create_replay_backendに渡す引数
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー
+    """
+    server = create_replay_backend(traces, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    """コマンドラインからトレースを再生するバックエンドを起動します。"""
+    parser = argparse.ArgumentParser(description='記録したトレースを再生するバックエンド')
+    parser.add_argument('traces', nargs='+', help='トレースファイルまたはそれを含むディレクトリ')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--speed', type=float, default=1.0, help='再生速度の倍率（0で待ち時間なし）')
+    parser.add_argument('--include-incomplete', action='store_true', help='途中で中断されたトレースも再生する')
+    args = parser.parse_args()
+
+    traces = load_traces(args.traces)
+    server = create_replay_backend(traces, args.host, args.port, args.speed, args.include_incomplete)
+    library = server.RequestHandlerClass.library
+    print(f'{len(library.traces)}件のトレースを再生します: http://{args.host}:{args.port}')
+    if library.stats['skipped_incomplete']:
+        print(f"途中で中断された{library.stats['skipped_incomplete']}件のトレースを除外しました"
+              "（--include-incompleteで再生対象に含めます）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
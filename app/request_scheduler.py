@@ -0,0 +1,362 @@
+"""
+バックエンドへのリクエストを優先度付きで制御するスケジューラーを提供するモジュール。
+対話（interactive）・自動会話（auto）・バッチ（batch）の優先度クラスごと、およびバックエンドごとに
+同時実行数を制限し、同一クラス内ではセッション間で順番に実行枠を割り当てます。
+対話リクエストが待たされる場合は、低優先度のストリームを一時停止またはキャンセルします。
+
+一時停止したストリームはバックエンドへの接続を保持したままのため、バックエンド側の生成枠や
+KVキャッシュは解放されません（受信を止めるだけです）。バックエンドの容量を対話リクエストに
+明け渡すにはキャンセルを使用します。
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from app.settings import get_setting
+
+# 優先度クラス（先頭ほど優先度が高い）
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_AUTO = 'auto'
+PRIORITY_BATCH = 'batch'
+PRIORITY_ORDER = [PRIORITY_INTERACTIVE, PRIORITY_AUTO, PRIORITY_BATCH]
+
+# 低優先度ストリームの扱い
+PREEMPT_PAUSE = 'pause'  # 対話リクエストの処理中は一時停止（バックエンドの生成枠は保持したまま）
+PREEMPT_CANCEL = 'cancel'  # 対話リクエストのためにキャンセル（バックエンドの生成枠を解放）
+
+class RequestCancelledError(Exception):
+    """スケジューラーによってリクエストがキャンセルされたことを表す例外"""
+    pass
+
+class RequestTicket:
+    """スケジューラーに登録された1リクエスト"""
+
+    def __init__(self, scheduler, priority, session_id, backend=None):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.session_id = session_id
+        self.backend = backend  # 送信先のバックエンド（URL）
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.granted = False  # 実行枠を割り当て済みか
+        self.paused = False  # 一時停止中か
+        self.cancelled = False  # キャンセル済みか
+
+    def checkpoint(self):
+        """
+        ストリームの受信ごとに呼び出し、一時停止中は再開まで待機します。
+
+        Raises:
+            RequestCancelledError: キャンセルされた場合
+        """
+        self.scheduler.wait_if_paused(self)
+
+    def release(self):
+        """try_acquire()で取得した実行枠を解放します。"""
+        self.scheduler.release(self)
+
+class RequestScheduler:
+    """優先度クラスごと・バックエンドごとの同時実行数制限と公平な待ち行列を備えたスケジューラー"""
+
+    def __init__(self, max_concurrency, class_limits, preempt=PREEMPT_CANCEL, backend_limit=None):
+        """
+        RequestSchedulerのコンストラクタ。
+
+        Args:
+            max_concurrency (int): 全体の同時実行数の上限
+            class_limits (dict): 優先度クラスごとの同時実行数の上限
+            preempt (str, optional): 低優先度ストリームの扱い（'pause', 'cancel', Noneで無効）
+            backend_limit (int, optional): バックエンドごとの同時実行数の上限（Noneで無制限）
+        """
+        if preempt not in (PREEMPT_PAUSE, PREEMPT_CANCEL, None):
+            raise ValueError(f"不正なプリエンプト設定です: {preempt}")
+        self.max_concurrency = max_concurrency
+        self.class_limits = {
+            priority: class_limits.get(priority, max_concurrency) for priority in PRIORITY_ORDER
+        }
+        self.preempt = preempt
+        self.backend_limit = backend_limit
+        # 優先度クラス -> セッションID -> 待ち行列（セッション間で順番に取り出す）
+        self.waiting = {priority: OrderedDict() for priority in PRIORITY_ORDER}
+        self.running = []
+        self.paused = []
+        self.stats = {
+            priority: {'completed': 0, 'cancelled': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+            for priority in PRIORITY_ORDER
+        }
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, priority, session_id=None, backend=None):
+        """
+        実行枠を取得します。枠が割り当てられるまで待機します。
+
+        Args:
+            priority (str): 優先度クラス
+            session_id (str, optional): 公平な割り当てに使用するセッションID
+            backend (str, optional): 送信先のバックエンド（URL）。バックエンドごとの上限の対象になる
+
+        Yields:
+            RequestTicket: 割り当てられたチケット（受信ごとにcheckpoint()を呼び出す）
+
+        Raises:
+            ValueError: 優先度クラスが不正な場合
+        """
+        if priority not in PRIORITY_ORDER:
+            raise ValueError(f"不正な優先度です: {priority}")
+
+        ticket = RequestTicket(self, priority, session_id, backend)
+        with self._condition:
+            self.waiting[priority].setdefault(session_id, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                self._condition.wait()
+
+            wait_time = ticket.started_at - ticket.enqueued_at
+            stats = self.stats[priority]
+            stats['total_wait'] += wait_time
+            stats['max_wait'] = max(stats['max_wait'], wait_time)
+
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def try_acquire(self, priority, session_id=None, backend=None):
+        """
+        待たずに取得できる場合のみ実行枠を取得します（ヘッジなど追加の送信用）。
+        同じか高い優先度のクラスに待ちがある場合は、それらを追い越さないよう取得しません。
+
+        Args:
+            priority (str): 優先度クラス
+            session_id (str, optional): セッションID
+            backend (str, optional): 送信先のバックエンド（URL）
+
+        Returns:
+            Optional[RequestTicket]: 取得したチケット（使用後にrelease()を呼び出す）。空きがない場合はNone。
+
+        Raises:
+            ValueError: 優先度クラスが不正な場合
+        """
+        if priority not in PRIORITY_ORDER:
+            raise ValueError(f"不正な優先度です: {priority}")
+
+        ticket = RequestTicket(self, priority, session_id, backend)
+        with self._condition:
+            higher_or_equal = PRIORITY_ORDER[:PRIORITY_ORDER.index(priority) + 1]
+            if (len(self.running) >= self.max_concurrency
+                    or self._count(self.running, priority) >= self.class_limits[priority]
+                    or not self._backend_available(ticket)
+                    or any(self._has_waiting(other) for other in higher_or_equal)):
+                return None
+            ticket.granted = True
+            ticket.started_at = ticket.enqueued_at
+            self.running.append(ticket)
+            return ticket
+
+    def release(self, ticket):
+        """
+        実行枠を解放し、待っているリクエストに割り当てます。
+
+        Args:
+            ticket (RequestTicket): 解放するチケット
+        """
+        with self._condition:
+            if not ticket.granted:
+                return  # 解放済み
+            if ticket in self.running:
+                self.running.remove(ticket)
+            if ticket in self.paused:
+                self.paused.remove(ticket)
+            ticket.granted = False
+            self.stats[ticket.priority]['cancelled' if ticket.cancelled else 'completed'] += 1
+            self._dispatch()
+            self._condition.notify_all()
+
+    def wait_if_paused(self, ticket):
+        """
+        一時停止中のチケットを再開まで待機させます。
+
+        Raises:
+            RequestCancelledError: キャンセルされた場合
+        """
+        with self._condition:
+            while ticket.paused and not ticket.cancelled:
+                self._condition.wait()
+            if ticket.cancelled:
+                raise RequestCancelledError("優先度の高いリクエストのためキャンセルされました")
+
+    def get_stats(self):
+        """
+        優先度クラスごとの状態を取得します。
+
+        Returns:
+            dict: 優先度クラス -> 待ち数、実行数、一時停止数、完了数、キャンセル数、平均・最大待ち時間
+        """
+        with self._condition:
+            result = {}
+            for priority in PRIORITY_ORDER:
+                stats = self.stats[priority]
+                started = stats['completed'] + stats['cancelled'] + self._count(self.running, priority) \
+                    + self._count(self.paused, priority)
+                result[priority] = {
+                    'queue_depth': sum(len(queue) for queue in self.waiting[priority].values()),
+                    'running': self._count(self.running, priority),
+                    'paused': self._count(self.paused, priority),
+                    'completed': stats['completed'],
+                    'cancelled': stats['cancelled'],
+                    'avg_wait': stats['total_wait'] / started if started else 0.0,
+                    'max_wait': stats['max_wait'],
+                }
+            return result
+
+    def get_backend_stats(self):
+        """
+        バックエンドごとの状態を取得します。
+
+        Returns:
+            dict: バックエンドのURL -> 待ち数、実行数、一時停止数
+        """
+        with self._condition:
+            result = {}
+            waiting = [ticket for queues in self.waiting.values() for queue in queues.values() for ticket in queue]
+            for name, tickets in (('waiting', waiting), ('running', self.running), ('paused', self.paused)):
+                for ticket in tickets:
+                    if ticket.backend is None:
+                        continue
+                    stats = result.setdefault(ticket.backend, {'waiting': 0, 'running': 0, 'paused': 0})
+                    stats[name] += 1
+            return result
+
+    def _count(self, tickets, priority):
+        """指定した優先度クラスのチケット数を数える"""
+        return sum(1 for ticket in tickets if ticket.priority == priority)
+
+    def _backend_available(self, ticket):
+        """チケットの送信先バックエンドに空きがあるか"""
+        if self.backend_limit is None or ticket.backend is None:
+            return True
+        running = sum(1 for other in self.running if other.backend == ticket.backend)
+        return running < self.backend_limit
+
+    def _has_waiting(self, priority):
+        """指定した優先度クラスに待ちがあるか"""
+        return any(self.waiting[priority].values())
+
+    def _pop_next(self, priority):
+        """
+        指定した優先度クラスの待ち行列から、セッション間で順番に次のチケットを取り出します。
+        送信先バックエンドが上限に達しているセッションは飛ばします。
+
+        Returns:
+            Optional[RequestTicket]: 取り出したチケット。実行可能なものがない場合はNone。
+        """
+        queues = self.waiting[priority]
+        for session_id, queue in queues.items():
+            if queue and self._backend_available(queue[0]):
+                break
+        else:
+            return None
+        ticket = queue.popleft()
+        del queues[session_id]
+        if queue:
+            # 同じセッションの残りは最後尾に回す
+            queues[session_id] = queue
+        return ticket
+
+    def _find_blocked_interactive(self):
+        """
+        全体またはバックエンドの空きがないために待っている対話リクエストを探します。
+        対話クラス自体の上限で待っている場合は、低優先度のストリームを退かせても実行できないため対象外です。
+
+        Returns:
+            tuple: (待っているチケットまたはNone, 送信先バックエンドが上限に達しているか)
+        """
+        if self._count(self.running, PRIORITY_INTERACTIVE) >= self.class_limits[PRIORITY_INTERACTIVE]:
+            return None, False
+        for queue in self.waiting[PRIORITY_INTERACTIVE].values():
+            if not queue:
+                continue
+            ticket = queue[0]
+            if len(self.running) >= self.max_concurrency:
+                return ticket, False
+            if not self._backend_available(ticket):
+                return ticket, True
+        return None, False
+
+    def _dispatch(self):
+        """待ち行列から実行可能なチケットに枠を割り当てます（ロック取得済みで呼び出す）。"""
+        interactive_pending = self._has_waiting(PRIORITY_INTERACTIVE)
+
+        # 対話リクエストが待っていて空きがない場合、低優先度のストリームを退かせる
+        blocked, backend_full = self._find_blocked_interactive() if self.preempt else (None, False)
+        if blocked is not None:
+            victims = sorted(
+                (ticket for ticket in self.running if ticket.priority != PRIORITY_INTERACTIVE
+                 and (not backend_full or ticket.backend == blocked.backend)),
+                key=lambda ticket: (-PRIORITY_ORDER.index(ticket.priority), -ticket.started_at)
+            )
+            if victims:
+                victim = victims[0]
+                self.running.remove(victim)
+                if self.preempt == PREEMPT_CANCEL:
+                    victim.cancelled = True
+                else:
+                    victim.paused = True
+                    self.paused.append(victim)
+                self._condition.notify_all()
+
+        # 対話リクエストがなければ一時停止中のストリームを再開
+        interactive_active = interactive_pending or self._count(self.running, PRIORITY_INTERACTIVE)
+        if not interactive_active:
+            for ticket in sorted(self.paused, key=lambda ticket: PRIORITY_ORDER.index(ticket.priority)):
+                if len(self.running) >= self.max_concurrency:
+                    break
+                if not self._backend_available(ticket):
+                    continue
+                self.paused.remove(ticket)
+                ticket.paused = False
+                self.running.append(ticket)
+                self._condition.notify_all()
+
+        # 優先度の高いクラスから順に枠を割り当てる
+        for priority in PRIORITY_ORDER:
+            while (len(self.running) < self.max_concurrency
+                   and self._count(self.running, priority) < self.class_limits[priority]
+                   and self._has_waiting(priority)):
+                # 一時停止中のストリームの再開を新規の低優先度リクエストより優先する
+                if priority != PRIORITY_INTERACTIVE and self.paused:
+                    break
+                ticket = self._pop_next(priority)
+                if ticket is None:
+                    break
+                ticket.granted = True
+                ticket.started_at = time.time()
+                self.running.append(ticket)
+                self._condition.notify_all()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_request_scheduler():
+    """
+    プロセス内で共有するRequestSchedulerを取得します。
+
+    Returns:
+        RequestScheduler: 共有スケジューラー
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(
+                max_concurrency=get_setting('SCHEDULER_MAX_CONCURRENCY', 4),
+                class_limits=get_setting('SCHEDULER_CLASS_LIMITS', {
+                    PRIORITY_INTERACTIVE: 4,
+                    PRIORITY_AUTO: 2,
+                    PRIORITY_BATCH: 1,
+                }),
+                preempt=get_setting('SCHEDULER_PREEMPT', PREEMPT_CANCEL),
+                backend_limit=get_setting('SCHEDULER_BACKEND_CONCURRENCY', 4),
+            )
+        return _scheduler
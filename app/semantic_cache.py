@@ -0,0 +1,302 @@
+"""
+埋め込みベクトルによる意味的な応答キャッシュを提供するモジュール。
+完全一致ではなく、言い回しの違う近似入力（挨拶や会話ラインの変種など）に対しても
+類似度がしきい値以上の過去の応答を再利用します。
+
+NumPyが必要です（pip install numpy）。キャッシュを有効にしない場合は不要です。
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from app.paths import ROOT_DIR
+from app.settings import get_setting
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class VectorIndex:
+    """
+    正規化済みベクトルを保持し、コサイン類似度で検索するインメモリのインデックス。
+    上限件数分の配列をリングバッファとして使い、超えた場合は古いものから上書きします。
+    """
+
+    def __init__(self, max_entries=10000):
+        """
+        VectorIndexのコンストラクタ。
+
+        Args:
+            max_entries (int, optional): 保持する件数の上限
+        """
+        if np is None:
+            raise ImportError("セマンティックキャッシュにはNumPyが必要です: pip install numpy")
+        self.max_entries = max_entries
+        self.vectors = None  # (上限件数, 次元)のfloat32配列。次元は最初の追加時に決定
+        self.scope_ids = np.zeros(max_entries, dtype=np.int64)  # 各エントリのスコープ
+        self.entries = [None] * max_entries  # 各エントリのメタデータ（answerなど）
+        self.count = 0  # 格納済みの件数
+        self.next_slot = 0  # 次に書き込む位置
+
+    @staticmethod
+    def normalize(vector):
+        """
+        ベクトルを単位長に正規化します。
+
+        Args:
+            vector (Sequence[float]): ベクトル
+
+        Returns:
+            numpy.ndarray: 正規化済みベクトル
+        """
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    @staticmethod
+    def to_scope_id(scope):
+        """スコープ文字列（16進ハッシュ）を整数IDに変換"""
+        return int(scope[:15], 16)
+
+    def add(self, vector, scope, entry):
+        """
+        ベクトルとメタデータを追加します。次元が異なる場合はインデックスを作り直します。
+
+        Args:
+            vector (numpy.ndarray): 正規化済みベクトル
+            scope (str): スコープ
+            entry (dict): メタデータ
+        """
+        if self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+            self.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self.count = 0
+            self.next_slot = 0
+
+        slot = self.next_slot
+        self.vectors[slot] = vector
+        self.scope_ids[slot] = self.to_scope_id(scope)
+        self.entries[slot] = entry
+        self.next_slot = (slot + 1) % self.max_entries
+        self.count = min(self.count + 1, self.max_entries)
+
+    def search(self, vector, scope):
+        """
+        同じスコープ内で最も類似したエントリを検索します。
+
+        Args:
+            vector (numpy.ndarray): 正規化済みベクトル
+            scope (str): 検索対象のスコープ
+
+        Returns:
+            tuple: (類似度, メタデータ)。該当がない場合は(None, None)。
+        """
+        if not self.count or self.vectors.shape[1] != vector.shape[0]:
+            return None, None
+        candidates = np.flatnonzero(self.scope_ids[:self.count] == self.to_scope_id(scope))
+        if not candidates.size:
+            return None, None
+        scores = self.vectors[candidates] @ vector
+        best = int(np.argmax(scores))
+        return float(scores[best]), self.entries[candidates[best]]
+
+    def save(self, path):
+        """
+        インデックスをファイルに保存します。
+
+        Args:
+            path (str): 保存先（.npz）
+        """
+        if not self.count:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # 書き込み途中のファイルを読まないよう、一時ファイル経由で置き換える
+        temp_path = path + '.tmp.npz'
+        np.savez(
+            temp_path,
+            vectors=self.vectors[:self.count],
+            scope_ids=self.scope_ids[:self.count],
+            entries=np.array(json.dumps(self.entries[:self.count], ensure_ascii=False)),
+            next_slot=np.array(self.next_slot),
+        )
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        """
+        ファイルからインデックスを読み込みます。
+
+        Args:
+            path (str): 保存先（.npz）
+        """
+        with np.load(path) as data:
+            vectors = data['vectors']
+            count = min(len(vectors), self.max_entries)
+            self.vectors = np.zeros((self.max_entries, vectors.shape[1]), dtype=np.float32)
+            self.vectors[:count] = vectors[:count]
+            self.scope_ids[:count] = data['scope_ids'][:count]
+            self.entries[:count] = json.loads(str(data['entries']))[:count]
+            self.count = count
+            self.next_slot = int(data['next_slot']) % self.max_entries
+
+class SemanticCache:
+    """
+    モードと直近の会話履歴をスコープとして、意味的に近い入力の応答を再利用するキャッシュ。
+    """
+
+    SAVE_INTERVAL = 50  # この件数を追加するごとに永続化する
+
+    def __init__(self, embed_func, threshold=0.95, history_turns=2, max_entries=10000, path=None):
+        """
+        SemanticCacheのコンストラクタ。
+
+        Args:
+            embed_func (Callable[[str], Sequence[float]]): テキストを埋め込みベクトルに変換する関数
+            threshold (float, optional): キャッシュを採用する類似度の下限
+            history_turns (int, optional): スコープに含める直近の発言数
+            max_entries (int, optional): 保持する件数の上限
+            path (str, optional): 永続化先（.npz）。Noneの場合は永続化しない
+        """
+        self.embed_func = embed_func
+        self.threshold = threshold
+        self.history_turns = history_turns
+        self.path = path
+        self.index = VectorIndex(max_entries)
+        self.stats = {'hits': 0, 'misses': 0, 'errors': 0, 'latency_saved': 0.0, 'lookup_time': 0.0}
+        self.unsaved_count = 0  # 前回の永続化以降に追加した件数
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                self.index.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"セマンティックキャッシュの読み込みに失敗しました: {e}")
+
+    def make_scope(self, mode, history, model=None, template=None):
+        """
+        モード、モデル、プロンプトテンプレートと直近の会話履歴からスコープを作成します。
+
+        モデルやテンプレートが異なれば応答も異なるため、別のスコープとして扱います。
+
+        Args:
+            mode (str): モード名
+            history (list): 役割付きの会話履歴（今回の入力を含まない）
+            model (str, optional): モデル名
+            template (str, optional): プロンプトテンプレート
+
+        Returns:
+            str: スコープ（ハッシュ値）
+        """
+        recent = history[-self.history_turns:] if self.history_turns else []
+        fingerprint = json.dumps([mode, model, template, recent], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+    def lookup(self, scope, text):
+        """
+        類似した過去の入力に対する応答を検索します。
+
+        Args:
+            scope (str): スコープ
+            text (str): 今回の入力
+
+        Returns:
+            tuple: (キャッシュされた応答またはNone, 入力の埋め込みベクトルまたはNone)
+        """
+        started_at = time.perf_counter()
+        try:
+            vector = VectorIndex.normalize(self.embed_func(text))
+        except Exception as e:
+            print(f"埋め込みの取得に失敗しました: {e}")
+            with self._lock:
+                self.stats['errors'] += 1
+            return None, None
+
+        with self._lock:
+            score, entry = self.index.search(vector, scope)
+            self.stats['lookup_time'] += time.perf_counter() - started_at
+            if entry is not None and score >= self.threshold:
+                self.stats['hits'] += 1
+                self.stats['latency_saved'] += max(0.0, entry['latency'] - (time.perf_counter() - started_at))
+                return entry['answer'], vector
+            self.stats['misses'] += 1
+        return None, vector
+
+    def store(self, scope, vector, text, answer, latency):
+        """
+        入力と応答をキャッシュに追加します。
+
+        Args:
+            scope (str): スコープ
+            vector (numpy.ndarray): lookupで取得した埋め込みベクトル
+            text (str): 入力
+            answer (str): 応答
+            latency (float): 応答の生成にかかった時間（秒）
+        """
+        with self._lock:
+            self.index.add(vector, scope, {'text': text, 'answer': answer, 'latency': latency})
+            self.unsaved_count += 1
+            should_save = self.unsaved_count >= self.SAVE_INTERVAL
+        if should_save:
+            self.save()
+
+    def save(self):
+        """永続化先が設定されている場合、インデックスを保存します。"""
+        if not self.path:
+            return
+        with self._lock:
+            self.unsaved_count = 0
+            try:
+                self.index.save(self.path)
+            except OSError as e:
+                print(f"セマンティックキャッシュの保存に失敗しました: {e}")
+
+    def get_stats(self):
+        """
+        ヒット率と削減できた待ち時間を取得します。
+
+        Returns:
+            dict: ヒット数、ミス数、ヒット率、削減時間（秒）、平均検索時間（秒）、件数
+        """
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'hits': self.stats['hits'],
+                'misses': self.stats['misses'],
+                'errors': self.stats['errors'],
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'latency_saved': self.stats['latency_saved'],
+                'avg_lookup_time': self.stats['lookup_time'] / lookups if lookups else 0.0,
+                'entries': self.index.count,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_semantic_cache(embed_func):
+    """
+    プロセス内で共有するSemanticCacheを取得します。無効の場合はNoneを返します。
+
+    Args:
+        embed_func (Callable[[str], Sequence[float]]): 初回生成時に使用する埋め込み関数
+
+    Returns:
+        Optional[SemanticCache]: 共有キャッシュ
+    """
+    global _cache
+    if not get_setting('SEMANTIC_CACHE_ENABLED', False):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            path = get_setting('SEMANTIC_CACHE_PATH')
+            _cache = SemanticCache(
+                embed_func,
+                threshold=get_setting('SEMANTIC_CACHE_THRESHOLD', 0.95),
+                history_turns=get_setting('SEMANTIC_CACHE_HISTORY_TURNS', 2),
+                max_entries=get_setting('SEMANTIC_CACHE_MAX_ENTRIES', 10000),
+                # 相対パスはプロジェクトルートからの位置として扱う
+                path=os.path.join(ROOT_DIR, path) if path else None,
+            )
+            atexit.register(_cache.save)
+        return _cache
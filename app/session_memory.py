@@ -0,0 +1,283 @@
+"""
+チャットセッションのメモリ使用量を管理するモジュール。
+プロセス全体のメモリ予算を超えた場合、最も長く使われていないセッションの状態をディスクに退避し、
+次回の操作時に透過的に復元します。
+一定時間操作のないセッションは管理情報を破棄します。退避済みのセッションの退避ファイルは保持期間まで残し、
+管理情報がなくても次回の操作時に復元します。
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from app.paths import ROOT_DIR
+from app.settings import get_setting
+
+def estimate_size(obj):
+    """
+    オブジェクトのおおよそのメモリ使用量を再帰的に見積もります。
+
+    Args:
+        obj (Any): 見積もり対象（list, dict, strなど）
+
+    Returns:
+        int: 見積もりバイト数
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(key) + estimate_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(estimate_size(item) for item in obj)
+    return size
+
+class SessionRecord:
+    """セッションごとの管理情報"""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.state = {}  # 状態名 -> セッションが保持するリスト
+        self.size = 0  # 見積もりバイト数
+        self.last_access = time.time()
+        self.active = 0  # 実行中のスクリプト数
+        self.evicted = False  # ディスクに退避済みか
+
+class SessionMemoryManager:
+    """
+    セッション状態のメモリ予算を管理するクラス。
+    状態はセッションが保持するリストへの参照として登録し、退避・復元はリストをその場で書き換えて行います。
+    """
+
+    EXPIRE_CHECK_INTERVAL = 60  # 期限切れセッションを確認する間隔（秒）
+
+    def __init__(self, budget_bytes, spill_dir, min_idle_seconds=60, expire_seconds=3600,
+                 spill_retention_seconds=7 * 24 * 3600):
+        """
+        SessionMemoryManagerのコンストラクタ。
+
+        Args:
+            budget_bytes (int): プロセス全体のメモリ予算（バイト）
+            spill_dir (str): 退避ファイルの保存先ディレクトリ
+            min_idle_seconds (float, optional): 退避対象とする最小アイドル時間（秒）
+            expire_seconds (float, optional): 管理情報を破棄するまでのアイドル時間（秒）
+            spill_retention_seconds (float, optional): 退避ファイルを削除するまでの保持期間（秒）
+        """
+        self.budget_bytes = budget_bytes
+        self.spill_dir = spill_dir
+        self.min_idle_seconds = min_idle_seconds
+        self.expire_seconds = expire_seconds
+        self.spill_retention_seconds = spill_retention_seconds
+        self.sessions = {}
+        self.eviction_count = 0
+        self.restore_count = 0
+        self.expired_count = 0
+        self.last_expire_check = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self, session_id, state):
+        """
+        セッションの実行中であることを登録します。
+
+        退避済みの場合は状態を復元し、実行終了時に使用量を再計算して予算超過分を退避します。
+        管理情報が破棄された後でも、退避ファイルが残っていれば復元します。
+        実行中のセッションは退避されません。
+
+        Args:
+            session_id (str): セッションID
+            state (dict): 状態名からセッションが保持するリストへの辞書
+
+        Yields:
+            bool: 退避済みの状態を復元した場合はTrue
+        """
+        with self._lock:
+            record = self.sessions.get(session_id)
+            if record is None:
+                record = SessionRecord(session_id)
+                self.sessions[session_id] = record
+                if os.path.exists(self._get_spill_path(session_id)):
+                    if any(state.values()):
+                        # メモリ上に状態がある場合、残っている退避ファイルは古いもの
+                        self._remove_spill_file(session_id)
+                    else:
+                        record.evicted = True
+            record.state = state
+            record.active += 1
+            restored = record.evicted and self._restore(record)
+
+        try:
+            yield restored
+        finally:
+            with self._lock:
+                record.active -= 1
+                record.last_access = time.time()
+                record.size = estimate_size(record.state)
+                self._expire_sessions()
+                self._enforce_budget(exclude=record)
+
+    def release(self, session_id):
+        """
+        セッションの管理を終了し、退避ファイルを削除します。
+
+        Args:
+            session_id (str): セッションID
+        """
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            self._remove_spill_file(session_id)
+
+    def _expire_sessions(self):
+        """
+        アイドル時間が期限を超えたセッションの管理情報を破棄します。
+
+        セッションが保持するリストへの参照を手放します。退避済みのセッションは画面が開いたままの
+        可能性があるため退避ファイルを残し、保持期間を過ぎた退避ファイルのみ削除します
+        （以前のプロセスが残したものを含む）。
+        """
+        now = time.time()
+        if now - self.last_expire_check < self.EXPIRE_CHECK_INTERVAL:
+            return
+        self.last_expire_check = now
+
+        for session_id, record in list(self.sessions.items()):
+            if record.active == 0 and now - record.last_access >= self.expire_seconds:
+                del self.sessions[session_id]
+                self.expired_count += 1
+
+        try:
+            file_names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        for file_name in file_names:
+            session_id, extension = os.path.splitext(file_name)
+            if extension != '.json' or session_id in self.sessions:
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(self.spill_dir, file_name)) >= self.spill_retention_seconds:
+                    self._remove_spill_file(session_id)
+            except OSError:
+                continue
+
+    def _remove_spill_file(self, session_id):
+        """退避ファイルがあれば削除（エラーは無視）"""
+        try:
+            os.remove(self._get_spill_path(session_id))
+        except OSError:
+            pass
+
+    def get_stats(self):
+        """
+        メモリ使用状況を取得します。
+
+        Returns:
+            dict: 使用量、予算、セッション数、退避・復元・期限切れの回数
+        """
+        with self._lock:
+            self._expire_sessions()
+            return {
+                'used_bytes': sum(record.size for record in self.sessions.values()),
+                'budget_bytes': self.budget_bytes,
+                'sessions': len(self.sessions),
+                'evicted_sessions': sum(1 for record in self.sessions.values() if record.evicted),
+                'evictions': self.eviction_count,
+                'restores': self.restore_count,
+                'expired': self.expired_count,
+            }
+
+    def _get_spill_path(self, session_id):
+        """退避ファイルのパスを取得"""
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _enforce_budget(self, exclude=None):
+        """
+        予算を超えている間、アイドル状態のセッションを最終利用の古い順に退避します。
+
+        Args:
+            exclude (SessionRecord, optional): 退避対象から除外するセッション（直前に操作されたもの）
+        """
+        used = sum(record.size for record in self.sessions.values())
+        if used <= self.budget_bytes:
+            return
+
+        now = time.time()
+        candidates = sorted(
+            (record for record in self.sessions.values()
+             if record is not exclude and not record.evicted and record.active == 0
+             and now - record.last_access >= self.min_idle_seconds),
+            key=lambda record: record.last_access
+        )
+        for record in candidates:
+            if used <= self.budget_bytes:
+                break
+            freed = record.size
+            if self._spill(record):
+                used -= freed
+
+    def _spill(self, record):
+        """
+        セッションの状態をディスクに退避し、メモリ上のリストを空にします。
+
+        Returns:
+            bool: 退避に成功した場合はTrue
+        """
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._get_spill_path(record.session_id), 'w', encoding='utf-8') as f:
+                json.dump({name: list(values) for name, values in record.state.items()}, f, ensure_ascii=False)
+        except (IOError, TypeError, ValueError) as e:
+            print(f"セッション状態の退避に失敗しました: {e}")
+            return False
+
+        for values in record.state.values():
+            values.clear()
+        record.size = estimate_size(record.state)
+        record.evicted = True
+        self.eviction_count += 1
+        return True
+
+    def _restore(self, record):
+        """
+        退避済みの状態をディスクから読み込み、セッションのリストに書き戻します。
+
+        Returns:
+            bool: 復元に成功した場合はTrue
+        """
+        spill_path = self._get_spill_path(record.session_id)
+        try:
+            with open(spill_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (IOError, ValueError) as e:
+            print(f"セッション状態の復元に失敗しました: {e}")
+            record.evicted = False
+            return False
+
+        for name, values in record.state.items():
+            values[:] = saved.get(name, [])
+        os.remove(spill_path)
+        record.evicted = False
+        self.restore_count += 1
+        return True
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_session_memory_manager():
+    """
+    プロセス内で共有するSessionMemoryManagerを取得します。
+
+    Returns:
+        SessionMemoryManager: 共有マネージャー
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SessionMemoryManager(
+                budget_bytes=get_setting('SESSION_MEMORY_BUDGET', 256 * 1024 * 1024),
+                # 相対パスはプロジェクトルートからの位置として扱う
+                spill_dir=os.path.join(ROOT_DIR, get_setting('SESSION_SPILL_DIR', '.sessions')),
+                min_idle_seconds=get_setting('SESSION_EVICT_IDLE_SECONDS', 60),
+                expire_seconds=get_setting('SESSION_EXPIRE_SECONDS', 3600),
+                spill_retention_seconds=get_setting('SESSION_SPILL_RETENTION_SECONDS', 7 * 24 * 3600),
+            )
+        return _manager
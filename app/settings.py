@@ -0,0 +1,26 @@
+"""
+オプション設定の取得を行うモジュール。
+config/__init__.pyに定義されていない任意の設定項目を既定値で補います。
+"""
+
+import os
+import sys
+
+# configモジュールのパスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+def get_setting(name, default=None):
+    """
+    config/__init__.pyから任意の設定項目を取得します。
+
+    既存の設定ファイルとの互換性を保つため、未定義の項目は既定値を返します。
+
+    Args:
+        name (str): 設定項目名
+        default (Any, optional): 未定義の場合に返す既定値
+
+    Returns:
+        Any: 設定値
+    """
+    return getattr(config, name, default)
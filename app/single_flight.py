@@ -0,0 +1,163 @@
+"""
+同一内容の実行中リクエストを1本のバックエンドストリームにまとめるモジュール（シングルフライト）。
+同じテンプレートと少数の会話ラインから多数のセッションが同時に自動会話を始めた場合などに、
+バイト単位で同一のリクエストを1回の生成で済ませ、受信したレコードを全ての購読者に配信します。
+
+途中から参加した購読者には、それまでに受信したレコードを先頭から再生します。
+購読者が途中で離脱しても、他の購読者がいる間は共有ストリームを継続します。
+バックエンドへの送信（スケジューラーの実行枠の取得を含む）は最初のリクエストの開始関数だけが行い、
+後から参加した購読者は実行枠を消費しません。
+"""
+
+import hashlib
+import json
+import threading
+from app.settings import get_setting
+
+class Flight:
+    """実行中の1本の共有ストリーム"""
+
+    def __init__(self, key):
+        self.key = key
+        self.records = []  # 受信済みのレコード
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+class SingleFlightGroup:
+    """同一キーの実行中リクエストを1本にまとめるクラス"""
+
+    def __init__(self):
+        self.flights = {}  # キー -> 実行中のFlight
+        self.stats = {'flights': 0, 'coalesced': 0, 'cancelled': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(urls, request_body, priority=None):
+        """
+        送信先とリクエストボディ（プロンプト、モデル、オプションなど）からキーを作成します。
+
+        共有ストリームは最初のリクエストの優先度でスケジューラーの実行枠を取得するため、
+        優先度の異なるリクエストはまとめません。
+
+        Args:
+            urls (list): 送信先URLの一覧
+            request_body (dict): リクエストボディ
+            priority (str, optional): 優先度クラス
+
+        Returns:
+            str: キー（ハッシュ値）
+        """
+        fingerprint = json.dumps([urls, request_body, priority], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+    def iter_records(self, key, start_func):
+        """
+        同じキーの実行中ストリームがあれば購読し、なければ新たに開始してレコードを返します。
+
+        Args:
+            key (str): リクエストのキー
+            start_func (Callable[[], Iterator[dict]]): バックエンドへの送信を開始し、レコードを返す関数
+
+        Yields:
+            dict: NDJSONの1行をパースしたもの
+
+        Raises:
+            Exception: 共有ストリームで発生したエラー
+        """
+        with self._lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.stats['coalesced'] += 1
+            else:
+                flight = Flight(key)
+                self.flights[key] = flight
+                self.stats['flights'] += 1
+                threading.Thread(target=self._run, args=(flight, start_func), daemon=True).start()
+            with flight.condition:
+                flight.subscribers += 1
+
+        position = 0
+        try:
+            while True:
+                with flight.condition:
+                    while position >= len(flight.records) and not flight.finished:
+                        flight.condition.wait()
+                    if position < len(flight.records):
+                        record = flight.records[position]
+                    elif flight.error is not None:
+                        raise flight.error
+                    else:
+                        return
+                position += 1
+                yield record
+        finally:
+            self._unsubscribe(flight)
+
+    def _unsubscribe(self, flight):
+        """購読を解除し、購読者がいなくなった未完了のストリームを中断します。"""
+        with self._lock:
+            with flight.condition:
+                flight.subscribers -= 1
+                if flight.subscribers or flight.finished:
+                    return
+                flight.cancelled = True
+            # 以降の同一リクエストは新しいストリームとして開始する
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            self.stats['cancelled'] += 1
+
+    def _run(self, flight, start_func):
+        """共有ストリームを受信し、レコードを購読者に配信します。"""
+        error = None
+        records = None
+        try:
+            records = start_func()
+            for record in records:
+                with flight.condition:
+                    if flight.cancelled:
+                        break
+                    flight.records.append(record)
+                    flight.condition.notify_all()
+        except Exception as e:
+            error = e
+        finally:
+            if records is not None and hasattr(records, 'close'):
+                records.close()  # 中断時はバックエンドへの接続を閉じる
+            with self._lock:
+                if self.flights.get(flight.key) is flight:
+                    del self.flights[flight.key]
+                with flight.condition:
+                    flight.error = error
+                    flight.finished = True
+                    flight.condition.notify_all()
+
+    def get_stats(self):
+        """
+        シングルフライトの状況を取得します。
+
+        Returns:
+            dict: 開始したストリーム数、まとめたリクエスト数、中断数、実行中のストリーム数
+        """
+        with self._lock:
+            return dict(self.stats, in_flight=len(self.flights))
+
+_group = None
+_group_lock = threading.Lock()
+
+def get_single_flight_group():
+    """
+    プロセス内で共有するSingleFlightGroupを取得します。無効の場合はNoneを返します。
+
+    Returns:
+        Optional[SingleFlightGroup]: 共有グループ
+    """
+    global _group
+    if not get_setting('SINGLE_FLIGHT_ENABLED', False):
+        return None
+    with _group_lock:
+        if _group is None:
+            _group = SingleFlightGroup()
+        return _group
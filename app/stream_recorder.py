@@ -0,0 +1,171 @@
+"""
+バックエンドのストリーミング応答を記録するモジュール。
+リクエストボディと、受信したNDJSONの各行をそのまま、行間の待ち時間とともにトレースファイルへ保存します。
+保存したトレースはapp.replay_backendで再生でき、GPUなしで実際の応答の形を再現できます。
+
+トレースファイルはgzip圧縮したJSON Lines形式（1行が1リクエスト）です:
+    {"version": 1, "recorded_at": 記録時刻, "url": URL, "request": リクエストボディ,
+     "header_delay": 応答ヘッダーまでの秒数, "chunks": [[前の行からの秒数, "NDJSONの行"], ...],
+     "complete": ストリームを最後まで受信したか}
+"""
+
+import glob
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from app.paths import ROOT_DIR
+from app.settings import get_setting
+
+TRACE_VERSION = 1
+
+class StreamTrace:
+    """記録中の1リクエストのトレース"""
+
+    def __init__(self, recorder, url, request_body, header_delay):
+        """
+        StreamTraceのコンストラクタ。
+
+        Args:
+            recorder (StreamRecorder): 記録先
+            url (str): APIエンドポイントのURL
+            request_body (dict): リクエストボディ
+            header_delay (float): 送信から応答ヘッダーの受信までの時間（秒）
+        """
+        self.recorder = recorder
+        self.record = {
+            'version': TRACE_VERSION,
+            'recorded_at': time.time(),
+            'url': url,
+            'request': request_body,
+            'header_delay': header_delay,
+            'chunks': [],
+            'complete': False,
+        }
+        self.last_time = time.perf_counter()
+
+    def add_chunk(self, line):
+        """
+        受信した1行を、前の行からの待ち時間とともに記録します。
+
+        Args:
+            line (bytes): NDJSONの1行（改行を除く）
+        """
+        now = time.perf_counter()
+        self.record['chunks'].append([round(now - self.last_time, 6), line.decode('utf-8', errors='replace')])
+        self.last_time = now
+
+    def finish(self, complete):
+        """
+        記録を終了し、トレースファイルに書き込みます。
+
+        Args:
+            complete (bool): ストリームを最後まで受信した場合はTrue
+        """
+        self.record['complete'] = complete
+        self.recorder.write(self.record)
+
+class StreamRecorder:
+    """トレースをファイルに追記するクラス"""
+
+    def __init__(self, directory, sample_rate=1.0):
+        """
+        StreamRecorderのコンストラクタ。
+
+        Args:
+            directory (str): トレースファイルの保存先
+            sample_rate (float, optional): 記録するリクエストの割合（0.0〜1.0）
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # プロセスごとに別のファイルに書き込む
+        self.path = os.path.join(directory, f"trace_{timestamp}_{os.getpid()}.jsonl.gz")
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def start(self, url, request_body, header_delay=0.0):
+        """
+        リクエストの記録を開始します。サンプリングで対象外になった場合はNoneを返します。
+
+        Args:
+            url (str): APIエンドポイントのURL
+            request_body (dict): リクエストボディ
+            header_delay (float, optional): 送信から応答ヘッダーの受信までの時間（秒）
+
+        Returns:
+            Optional[StreamTrace]: 記録中のトレース
+        """
+        if random.random() >= self.sample_rate:
+            return None
+        return StreamTrace(self, url, request_body, header_delay)
+
+    def write(self, record):
+        """
+        トレースを1件追記します。
+
+        1件ごとに独立したgzipメンバーとして追記するため、途中で異常終了しても
+        書き込み済みのトレースは読み込めます。
+
+        Args:
+            record (dict): トレース
+        """
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with gzip.open(self.path, 'ab') as file:
+                    file.write(line)
+                self.recorded += 1
+            except OSError as e:
+                print(f"トレースの保存に失敗しました: {e}")
+
+def load_traces(paths):
+    """
+    トレースファイルを読み込みます。
+
+    Args:
+        paths (list): トレースファイルまたはそれを含むディレクトリのパスの一覧
+
+    Returns:
+        list: トレースの一覧（ファイル名順、ファイル内は記録順）
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.jsonl.gz'))))
+        else:
+            files.append(path)
+
+    traces = []
+    for file_path in files:
+        with gzip.open(file_path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    traces.append(json.loads(line))
+    return traces
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_stream_recorder():
+    """
+    プロセス内で共有するStreamRecorderを取得します。無効の場合はNoneを返します。
+
+    Returns:
+        Optional[StreamRecorder]: 共有レコーダー
+    """
+    global _recorder
+    if not get_setting('STREAM_RECORD_ENABLED', False):
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = StreamRecorder(
+                # 相対パスはプロジェクトルートからの位置として扱う
+                os.path.join(ROOT_DIR, get_setting('STREAM_RECORD_DIR', '.traces')),
+                sample_rate=get_setting('STREAM_RECORD_SAMPLE_RATE', 1.0),
+            )
+        return _recorder
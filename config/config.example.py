@@ -1,5 +1,6 @@
 # APIエンドポイントの設定
 URL = 'http://localhost:11434/api/generate'  # Ollama APIのデフォルトエンドポイント
+CHAT_URL = 'http://localhost:11434/api/chat'  # api_type='chat'のモードで使用するエンドポイント
 
 # アプリケーションの基本設定
 YOU = 'ユーザー'  # ユーザーの表示名
@@ -11,6 +12,61 @@ MODE_NORMAL = 'normal'  # 通常モード（サンプルとして提供）
 MODE_CUSTOM = 'custom'  # カスタムモード
 CURRENT_MODE = MODE_NORMAL  # デフォルトモード
 
+# モデル常駐設定
+KEEP_ALIVE_INTERVAL = 240  # 常駐延長のウォームアップ間隔（秒）。各モードのkeep_aliveより短くする
+KEEP_ALIVE_IDLE_TIMEOUT = 1800  # 最後の利用からこの秒数を過ぎたモードは常駐延長を停止
+
+# セッションメモリ設定
+SESSION_MEMORY_BUDGET = 256 * 1024 * 1024  # 全セッション合計のメモリ予算（バイト）
+SESSION_EVICT_IDLE_SECONDS = 60  # この秒数以上操作のないセッションを退避対象とする
+SESSION_SPILL_DIR = '.sessions'  # 退避したセッション状態の保存先
+SESSION_EXPIRE_SECONDS = 3600  # この秒数以上操作のないセッションの管理情報を破棄（退避ファイルは残す）
+SESSION_SPILL_RETENTION_SECONDS = 7 * 24 * 3600  # 退避ファイルの保持期間（秒）
+
+# リクエストスケジューラー設定（対話 > 自動会話 > バッチの優先度で実行枠を割り当て）
+SCHEDULER_MAX_CONCURRENCY = 4  # 全体の同時リクエスト数の上限
+SCHEDULER_CLASS_LIMITS = {'interactive': 4, 'auto': 2, 'batch': 1}  # 優先度クラスごとの上限
+SCHEDULER_BACKEND_CONCURRENCY = 4  # バックエンドごとの同時リクエスト数の上限
+# 対話リクエストが待つ場合の低優先度ストリームの扱い（'cancel', 'pause', None）
+# 'pause'は受信を止めるだけで、バックエンドの生成枠とKVキャッシュは解放されない
+SCHEDULER_PREEMPT = 'cancel'
+
+# 会話ラインの索引設定
+LINE_INDEX_DIR = '.line_index'  # 会話ラインファイルの行位置の索引の保存先
+
+# シングルフライト設定
+SINGLE_FLIGHT_ENABLED = False  # 同一内容の実行中リクエストを1本のバックエンドストリームにまとめる
+
+# ストリーム記録設定（app.replay_backendで再生可能なトレースを保存）
+STREAM_RECORD_ENABLED = False  # バックエンドのストリーミング応答を記録
+STREAM_RECORD_SAMPLE_RATE = 1.0  # 記録するリクエストの割合（0.0〜1.0）
+STREAM_RECORD_DIR = '.traces'  # トレースファイルの保存先
+
+# ヘッジリクエスト設定（モード設定のhedge_urlsに予備のバックエンドを指定した場合に使用）
+HEDGE_ENABLED = False  # ヘッジリクエストを有効化
+HEDGE_PERCENTILE = 95  # 最初のトークンがこのパーセンタイルのTTFTを超えたら予備に送信
+HEDGE_BUDGET_RATIO = 0.05  # ヘッジ送信数の上限（全リクエストに対する割合）
+HEDGE_MIN_SAMPLES = 20  # パーセンタイルの計算に必要なTTFTのサンプル数
+HEDGE_DEFAULT_DELAY = 2.0  # サンプルが不足している間のヘッジまでの待ち時間（秒）
+
+# セマンティックキャッシュ設定（NumPyが必要）
+SEMANTIC_CACHE_ENABLED = False  # 意味的に近い入力への応答を再利用
+SEMANTIC_CACHE_THRESHOLD = 0.95  # キャッシュを採用するコサイン類似度の下限
+SEMANTIC_CACHE_HISTORY_TURNS = 2  # キャッシュのスコープに含める直近の発言数
+SEMANTIC_CACHE_MAX_ENTRIES = 10000  # 保持する件数の上限
+SEMANTIC_CACHE_EMBED_MODEL = 'nomic-embed-text'  # 埋め込みに使用するモデル
+SEMANTIC_CACHE_PATH = None  # 永続化先（例: '.cache/semantic_cache.npz'）。Noneの場合は永続化しない
+EMBED_URL = 'http://localhost:11434/api/embed'  # 埋め込みAPIのエンドポイント
+
+# プロファイリング設定（環境変数LLM_CHAT_PROFILE=1でも有効化可能）
+PROFILING_ENABLED = False  # 計測スパンと開発者向けサイドバーを有効化
+PROFILING_SAMPLE_RATE = 0.0  # 再実行ごとにCPUプロファイルを保存する確率（0.0〜1.0）
+PROFILING_DIR = '.profiles'  # CPUプロファイルの保存先
+
+# ヘッドレスサーバー設定（python -m app.chat_server）
+SERVER_MAX_SESSIONS = 1000  # 保持するセッション数の上限（超えた場合は最も古いセッションを破棄）
+SERVER_BACKEND_QUEUE_LIMIT = 64  # バックエンドごとの待ち行列の上限（超えた場合は503を返す）
+
 def message_generator(base_line):
     """会話メッセージの生成関数の例"""
     return base_line
@@ -24,7 +80,17 @@ MODES = {
             'you_lines': 'templates/prompts/normal/default_you_lines.txt'
         },
         'response_end_marker': '」',  # 応答の終了を示すマーカー
-        'message_generator': message_generator  # メッセージ生成関数
+        'message_generator': message_generator,  # メッセージ生成関数
+        'api_type': 'generate',  # 'generate'（平文プロンプト）または'chat'（構造化メッセージ）
+        'keep_alive': '5m',  # モデルの常駐時間（省略時はサーバーの既定値）
+        'hedge_urls': [],  # ヘッジ先の予備バックエンドのエンドポイント（同じモデルを配置）
+        'you_lines_weighted': False,  # 会話ラインを「重み<TAB>テキスト」形式として扱う
+        'you_lines_no_repeat': False,  # セッション内で一巡するまで同じ会話ラインを選ばない
+        'options': {  # 生成オプション（Ollamaのoptionsとして毎回送信）
+            'temperature': 0.8,
+            'num_predict': 128  # 応答の最大トークン数（1行で答えるモードでは小さくして最悪の待ち時間を抑える）
+        },
+        'num_ctx_buckets': [2048, 4096, 8192]  # プロンプト長に応じて選ぶnum_ctxの段階（省略時はoptionsのまま）
     },
     MODE_CUSTOM: {
         'display_name': 'カスタムモード',
@@ -53,6 +119,9 @@ MODES = {
 4. モードの設定：
    - 各モードの設定をMODESディクショナリで定義
    - 必要に応じて新しいモードを追加可能
+   - modelを指定するとモードごとに使用するモデルを切り替えられます（省略時はMODEL）
+   - api_typeに'chat'を指定すると/api/chatを使用し、テンプレートをsystemメッセージ、
+     会話履歴を役割付きメッセージとして送信します（省略時は'generate'）
 
 セキュリティに関する注意：
 * センシティブな情報は直接このファイルに記載せず、
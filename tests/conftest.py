@@ -0,0 +1,26 @@
+"""
+テスト共通の設定。
+
+config/__init__.pyが用意されていない環境では、config/config.example.pyをconfigモジュールとして読み込みます。
+"""
+
+import importlib.util
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+try:
+    import config
+    # config/__init__.pyがない場合、configディレクトリが名前空間パッケージとして読み込まれる
+    configured = hasattr(config, 'URL')
+except ImportError:
+    configured = False
+
+if not configured:
+    spec = importlib.util.spec_from_file_location('config', os.path.join(ROOT_DIR, 'config', 'config.example.py'))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    sys.modules['config'] = config
@@ -0,0 +1,171 @@
+"""
+ヘッドレスサーバー（app.chat_server）のテスト。
+スタンドインバックエンドとサーバーを空きポートで起動し、HTTP経由で動作を確認します。
+"""
+
+import http.client
+import json
+import threading
+import pytest
+import requests
+import app.main
+from app.chat_server import ChatServer
+from app.mock_backend import create_mock_backend
+
+REPLY_TEXT = '「こんにちは！今日はいい天気ですね。」'
+
+def start_server(server):
+    """サーバーをバックグラウンドスレッドで起動"""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@pytest.fixture
+def backend(monkeypatch):
+    """スタンドインバックエンドを起動し、LLMAPIの送信先に設定"""
+    server = start_server(create_mock_backend(delay=0.02, reply_text=REPLY_TEXT))
+    monkeypatch.setattr(app.main, 'URL', f'http://127.0.0.1:{server.server_address[1]}/api/generate')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def chat_server(backend):
+    """チャットサーバーを空きポートで起動"""
+    server = start_server(ChatServer(('127.0.0.1', 0)))
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def create_session(chat_server):
+    """セッションを作成してIDを返す"""
+    response = requests.post(f'{chat_server.base_url}/sessions', json={'mode': 'normal'})
+    assert response.status_code == 201
+    return response.json()['session_id']
+
+def open_message_stream(chat_server, session_id, message='こんにちは'):
+    """メッセージを送信し、ストリーミング応答を開く"""
+    return requests.post(
+        f'{chat_server.base_url}/sessions/{session_id}/messages', json={'message': message}, stream=True
+    )
+
+def read_first_record(response):
+    """ストリーミング応答の最初のレコードを読み込む（生成中であることの確認に使用）"""
+    return json.loads(next(response.iter_lines(chunk_size=1)))
+
+def get_history(chat_server, session_id):
+    """会話履歴を取得"""
+    response = requests.get(f'{chat_server.base_url}/sessions/{session_id}/history')
+    assert response.status_code == 200
+    return response.json()['history']
+
+def test_stream_message_and_history(chat_server):
+    session_id = create_session(chat_server)
+
+    with open_message_stream(chat_server, session_id) as response:
+        assert response.status_code == 200
+        records = [json.loads(line) for line in response.iter_lines() if line]
+
+    chunks = ''.join(record.get('response', '') for record in records if not record.get('done'))
+    assert chunks == REPLY_TEXT
+    assert records[-1] == {'done': True, 'response': REPLY_TEXT}
+    assert get_history(chat_server, session_id) == [
+        {'role': 'user', 'content': 'こんにちは'},
+        {'role': 'assistant', 'content': REPLY_TEXT},
+    ]
+
+def test_non_stream_message(chat_server):
+    session_id = create_session(chat_server)
+
+    response = requests.post(
+        f'{chat_server.base_url}/sessions/{session_id}/messages?stream=false', json={'message': 'こんにちは'}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {'response': REPLY_TEXT}
+
+def test_delete_session(chat_server):
+    session_id = create_session(chat_server)
+
+    response = requests.delete(f'{chat_server.base_url}/sessions/{session_id}')
+    assert response.status_code == 200
+    assert requests.get(f'{chat_server.base_url}/sessions/{session_id}/history').status_code == 404
+    assert requests.delete(f'{chat_server.base_url}/sessions/{session_id}').status_code == 404
+
+def test_invalid_message(chat_server):
+    session_id = create_session(chat_server)
+
+    response = requests.post(f'{chat_server.base_url}/sessions/{session_id}/messages', json={'message': 1})
+    assert response.status_code == 400
+
+def test_concurrent_send_is_rejected(chat_server):
+    session_id = create_session(chat_server)
+
+    with open_message_stream(chat_server, session_id) as response:
+        read_first_record(response)
+        second = requests.post(f'{chat_server.base_url}/sessions/{session_id}/messages', json={'message': '2回目'})
+        assert second.status_code == 409
+        for _ in response.iter_lines():
+            pass
+
+def test_full_backend_queue_is_rejected(chat_server):
+    chat_server.backend_limiter.max_concurrency = 1
+    chat_server.backend_limiter.max_queue = 0
+    busy_session = create_session(chat_server)
+    other_session = create_session(chat_server)
+
+    with open_message_stream(chat_server, busy_session) as response:
+        read_first_record(response)
+        second = requests.post(f'{chat_server.base_url}/sessions/{other_session}/messages', json={'message': 'やあ'})
+        assert second.status_code == 503
+        for _ in response.iter_lines():
+            pass
+
+    assert get_history(chat_server, other_session) == []
+
+def test_full_session_store_is_rejected(chat_server):
+    chat_server.session_store.max_sessions = 1
+    session_id = create_session(chat_server)
+
+    with open_message_stream(chat_server, session_id) as response:
+        read_first_record(response)
+        # 生成中のセッションは破棄できないため新規作成を拒否する
+        second = requests.post(f'{chat_server.base_url}/sessions', json={'mode': 'normal'})
+        assert second.status_code == 503
+        for _ in response.iter_lines():
+            pass
+
+def test_client_disconnect_rolls_back_history(backend, chat_server):
+    backend.RequestHandlerClass.reply_text = 'あ' * 400
+    session_id = create_session(chat_server)
+
+    response = open_message_stream(chat_server, session_id)
+    read_first_record(response)
+    response.close()  # 応答の途中で切断
+
+    # 履歴の取得は送信処理がセッションのロックを解放するまで待つ
+    assert get_history(chat_server, session_id) == []
+
+def test_backend_error_rolls_back_history(chat_server, monkeypatch):
+    monkeypatch.setattr(app.main, 'URL', 'http://127.0.0.1:9/api/generate')  # 接続できないバックエンド
+    session_id = create_session(chat_server)
+
+    with open_message_stream(chat_server, session_id) as response:
+        records = [json.loads(line) for line in response.iter_lines() if line]
+
+    assert records[-1]['done'] and 'error' in records[-1]
+    assert get_history(chat_server, session_id) == []
+
+@pytest.mark.parametrize('headers, body', [
+    ({'Content-Length': 'abc'}, b''),
+    ({'Content-Length': '9'}, b'{"a\xff": 1}'),
+])
+def test_malformed_body_is_rejected(chat_server, headers, body):
+    connection = http.client.HTTPConnection('127.0.0.1', chat_server.server_address[1], timeout=10)
+    connection.putrequest('POST', '/sessions')
+    for name, value in headers.items():
+        connection.putheader(name, value)
+    connection.endheaders(body)
+    response = connection.getresponse()
+    assert response.status == 400
+    connection.close()
@@ -0,0 +1,79 @@
+"""
+生成オプション（app.generation_options）のテスト。
+"""
+
+import types
+import pytest
+from app import generation_options
+from app.generation_options import build_generation_options, parse_keep_alive, select_num_ctx
+
+BACKEND = ('http://127.0.0.1:11434/api/generate', 'test-model')
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    """num_ctxの最大値の記録を空にし、時刻を固定する"""
+    monkeypatch.setattr(generation_options, '_num_ctx_high_water', {})
+    fake_clock = FakeClock()
+    monkeypatch.setattr(generation_options, 'time', types.SimpleNamespace(monotonic=fake_clock))
+    return fake_clock
+
+def make_mode_config(**kwargs):
+    return dict({'options': {'num_predict': 64}, 'num_ctx_buckets': [2048, 4096, 8192]}, **kwargs)
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 300),
+    (60, 60.0),
+    ('120', 120.0),
+    ('5m', 300.0),
+    ('1h30m', 5400.0),
+    ('500ms', 0.5),
+    ('0', 0.0),
+    (-1, None),
+    ('-1m', None),
+    ('forever', None),
+])
+def test_parse_keep_alive(value, expected):
+    assert parse_keep_alive(value) == expected
+
+def test_select_num_ctx():
+    assert select_num_ctx(1000, [4096, 2048]) == 2048
+    assert select_num_ctx(3000, [2048, 4096]) == 4096
+    assert select_num_ctx(10000, [2048, 4096]) == 4096
+    assert select_num_ctx(1000, [2048, 4096], current=4096) == 4096
+
+def test_num_ctx_is_not_shrunk_while_model_is_loaded(clock):
+    mode_config = make_mode_config(keep_alive='5m')
+    assert build_generation_options(mode_config, 3000, BACKEND)['num_ctx'] == 4096
+
+    clock.now += 200
+    assert build_generation_options(mode_config, 100, BACKEND)['num_ctx'] == 4096
+    # ウォームアップなどで使用するたびに期限が延びる
+    clock.now += 200
+    assert build_generation_options(mode_config, 100, BACKEND)['num_ctx'] == 4096
+
+def test_num_ctx_high_water_lapses_with_keep_alive(clock):
+    mode_config = make_mode_config(keep_alive='5m')
+    assert build_generation_options(mode_config, 3000, BACKEND)['num_ctx'] == 4096
+
+    clock.now += 301
+    assert build_generation_options(mode_config, 100, BACKEND)['num_ctx'] == 2048
+
+def test_num_ctx_high_water_is_kept_for_infinite_keep_alive(clock):
+    mode_config = make_mode_config(keep_alive=-1)
+    assert build_generation_options(mode_config, 3000, BACKEND)['num_ctx'] == 4096
+
+    clock.now += 86400
+    assert build_generation_options(mode_config, 100, BACKEND)['num_ctx'] == 4096
+
+def test_num_ctx_high_water_is_per_backend(clock):
+    mode_config = make_mode_config()
+    assert build_generation_options(mode_config, 3000, BACKEND)['num_ctx'] == 4096
+    assert build_generation_options(mode_config, 100, (BACKEND[0], 'other-model'))['num_ctx'] == 2048
+    assert build_generation_options(mode_config, 100)['num_ctx'] == 2048
@@ -0,0 +1,154 @@
+"""
+ヘッジリクエスト（app.hedging）のテスト。
+スタンドインバックエンドと、接続を受け付けるだけで応答しないバックエンドを空きポートで起動して確認します。
+"""
+
+import socket
+import threading
+import time
+import pytest
+from app.hedging import HedgePolicy, TTFTTracker
+from app.main import open_stream, iter_stream_records
+from app.mock_backend import start_mock_backend
+from app.request_scheduler import RequestScheduler, PRIORITY_AUTO
+
+REPLY_TEXT = '「ヘッジのテストです。」'
+REQUEST_BODY = {'model': 'test', 'prompt': 'こんにちは', 'stream': True}
+
+class SilentBackend:
+    """接続を受け付けて応答を返さず、クライアントからの切断を検知するバックエンド"""
+
+    def __init__(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.url = f'http://127.0.0.1:{self.server.getsockname()[1]}/api/generate'
+        self.accepted = threading.Event()
+        self.closed = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        try:
+            connection, _ = self.server.accept()
+        except OSError:
+            return
+        self.accepted.set()
+        with connection:
+            while connection.recv(4096):
+                pass
+        self.closed.set()
+
+    def close(self):
+        self.server.close()
+
+@pytest.fixture
+def backend():
+    server = start_mock_backend(delay=0.01, reply_text=REPLY_TEXT)
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/api/generate'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def slow_backend():
+    server = start_mock_backend(delay=0.2, reply_text=REPLY_TEXT)
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/api/generate'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def silent_backend():
+    backend = SilentBackend()
+    yield backend
+    backend.close()
+
+def wait_until(condition, timeout=2.0):
+    """条件が満たされるまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def make_policy(budget_ratio=1.0, default_delay=0.05):
+    """サンプル不足の間はdefault_delayでヘッジするポリシーを作成"""
+    return HedgePolicy(
+        enabled=True, percentile=95, budget_ratio=budget_ratio, min_samples=1000, default_delay=default_delay
+    )
+
+def collect_text(records):
+    """レコードから応答テキストを連結"""
+    return ''.join(record.get('response', '') for record in records)
+
+def test_hedge_wins_and_disconnects_primary_waiting_for_headers(backend, silent_backend):
+    policy = make_policy()
+
+    records = policy.iter_records([silent_backend.url, backend.url], REQUEST_BODY, open_stream, iter_stream_records)
+
+    assert collect_text(records) == REPLY_TEXT
+    assert silent_backend.accepted.is_set()
+    # 応答ヘッダーを待っている主バックエンドへの接続も切断される
+    assert silent_backend.closed.wait(2)
+    stats = policy.get_stats()
+    assert stats['hedges'] == 1
+    assert stats['hedge_wins'] == 1
+
+def test_failover_when_primary_is_unreachable(backend):
+    with socket.create_server(('127.0.0.1', 0)) as unused:
+        unreachable_url = f'http://127.0.0.1:{unused.getsockname()[1]}/api/generate'
+    policy = make_policy(budget_ratio=0.0)
+
+    records = policy.iter_records([unreachable_url, backend.url], REQUEST_BODY, open_stream, iter_stream_records)
+
+    assert collect_text(records) == REPLY_TEXT
+    assert policy.get_stats()['hedges'] == 0
+
+def test_no_hedge_without_budget(slow_backend, silent_backend):
+    policy = make_policy(budget_ratio=0.0, default_delay=0.01)
+
+    records = policy.iter_records([slow_backend.url, silent_backend.url], REQUEST_BODY, open_stream, iter_stream_records)
+
+    assert collect_text(records) == REPLY_TEXT
+    assert not silent_backend.accepted.is_set()
+    assert policy.get_stats()['hedges'] == 0
+
+def test_hedge_skipped_when_backend_is_full(slow_backend, silent_backend):
+    scheduler = RequestScheduler(max_concurrency=4, class_limits={}, backend_limit=1)
+    policy = make_policy(default_delay=0.01)
+
+    with scheduler.slot(PRIORITY_AUTO, 'other', silent_backend.url):
+        records = policy.iter_records(
+            [slow_backend.url, silent_backend.url], REQUEST_BODY, open_stream, iter_stream_records,
+            acquire_func=lambda url: scheduler.try_acquire(PRIORITY_AUTO, 'session', url)
+        )
+        assert collect_text(records) == REPLY_TEXT
+
+    assert not silent_backend.accepted.is_set()
+    # 送信しなかったヘッジは予算を消費しない
+    assert policy.get_stats()['hedges'] == 0
+
+def test_hedge_slot_is_released_after_cancel(backend, silent_backend):
+    scheduler = RequestScheduler(max_concurrency=4, class_limits={}, backend_limit=1)
+    policy = make_policy()
+
+    records = policy.iter_records(
+        [silent_backend.url, backend.url], REQUEST_BODY, open_stream, iter_stream_records,
+        acquire_func=lambda url: scheduler.try_acquire(PRIORITY_AUTO, 'session', url)
+    )
+    assert next(records).get('response')
+    assert scheduler.get_backend_stats()[backend.url]['running'] == 1
+    records.close()
+
+    assert silent_backend.closed.wait(2)
+    # 採用された予備の送信が終了すると実行枠が解放される
+    assert wait_until(lambda: backend.url not in scheduler.get_backend_stats())
+
+def test_ttft_percentile():
+    tracker = TTFTTracker()
+    assert tracker.percentile(95) is None
+    for value in range(1, 101):
+        tracker.record(value / 100)
+
+    assert tracker.percentile(50) == 0.5
+    assert tracker.percentile(95) == 0.95
+    assert tracker.percentile(100) == 1.0
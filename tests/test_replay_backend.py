@@ -0,0 +1,39 @@
+"""
+トレースを再生するバックエンド（app.replay_backend）のテスト。
+"""
+
+from app.replay_backend import TraceLibrary
+
+def make_trace(prompt, complete=True, path='/api/generate'):
+    return {
+        'url': f'http://127.0.0.1:11434{path}',
+        'request': {'model': 'test', 'prompt': prompt, 'stream': True},
+        'chunks': [[0.0, '{"response": "a", "done": false}']],
+        'complete': complete,
+    }
+
+def test_incomplete_traces_are_excluded_by_default():
+    complete = make_trace('完了')
+    incomplete = make_trace('中断', complete=False)
+    library = TraceLibrary([complete, incomplete])
+
+    assert library.traces == [complete]
+    assert library.stats['skipped_incomplete'] == 1
+    # 一致する完了済みのトレースがない場合も、中断されたトレースは巡回再生されない
+    assert library.find('/api/generate', incomplete['request']) is complete
+    assert library.find('/api/chat', {'prompt': 'その他'}) is complete
+
+def test_include_incomplete():
+    incomplete = make_trace('中断', complete=False)
+    library = TraceLibrary([incomplete], include_incomplete=True)
+
+    assert library.find('/api/generate', incomplete['request']) is incomplete
+    assert library.stats['exact'] == 1
+
+def test_sequential_replay_per_path():
+    first, second = make_trace('1'), make_trace('2')
+    library = TraceLibrary([first, second])
+
+    found = [library.find('/api/generate', {'prompt': 'x'}) for _ in range(3)]
+    assert found == [first, second, first]
+    assert library.stats['sequential'] == 3
@@ -0,0 +1,171 @@
+"""
+リクエストスケジューラー（app.request_scheduler）のテスト。
+"""
+
+import threading
+import time
+import pytest
+from app.request_scheduler import (
+    RequestScheduler, RequestCancelledError, PRIORITY_INTERACTIVE, PRIORITY_AUTO, PREEMPT_CANCEL, PREEMPT_PAUSE
+)
+
+class Holder:
+    """別スレッドで実行枠を保持し、release()まで解放しない"""
+
+    def __init__(self, scheduler, priority, session_id, backend=None):
+        self.granted = threading.Event()
+        self.released = threading.Event()
+        self.cancelled = False
+        self.thread = threading.Thread(
+            target=self.run, args=(scheduler, priority, session_id, backend), daemon=True
+        )
+        self.thread.start()
+
+    def run(self, scheduler, priority, session_id, backend):
+        try:
+            with scheduler.slot(priority, session_id, backend) as ticket:
+                self.granted.set()
+                while not self.released.wait(0.01):
+                    ticket.checkpoint()
+        except RequestCancelledError:
+            self.cancelled = True
+
+    def release(self):
+        self.released.set()
+        self.thread.join(timeout=5)
+
+def wait_until(condition, timeout=2.0):
+    """条件が満たされるまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def make_scheduler(max_concurrency=4, interactive=4, auto=4, preempt=PREEMPT_CANCEL, backend_limit=None):
+    return RequestScheduler(
+        max_concurrency, {PRIORITY_INTERACTIVE: interactive, PRIORITY_AUTO: auto},
+        preempt=preempt, backend_limit=backend_limit
+    )
+
+def test_invalid_priority():
+    scheduler = make_scheduler()
+    with pytest.raises(ValueError):
+        with scheduler.slot('unknown'):
+            pass
+
+def test_class_limit_queues_requests():
+    scheduler = make_scheduler(auto=1)
+    first = Holder(scheduler, PRIORITY_AUTO, 'a')
+    second = Holder(scheduler, PRIORITY_AUTO, 'b')
+    assert first.granted.wait(1)
+    assert not second.granted.wait(0.1)
+    assert scheduler.get_stats()[PRIORITY_AUTO]['queue_depth'] == 1
+
+    first.release()
+    assert second.granted.wait(1)
+    second.release()
+
+def test_backend_limit_does_not_block_other_backends():
+    scheduler = make_scheduler(backend_limit=1)
+    busy = Holder(scheduler, PRIORITY_AUTO, 'a', 'http://a')
+    waiting = Holder(scheduler, PRIORITY_AUTO, 'b', 'http://a')
+    other = Holder(scheduler, PRIORITY_AUTO, 'c', 'http://b')
+    assert busy.granted.wait(1) and other.granted.wait(1)
+    assert not waiting.granted.wait(0.1)
+    assert scheduler.get_backend_stats()['http://a'] == {'waiting': 1, 'running': 1, 'paused': 0}
+
+    busy.release()
+    assert waiting.granted.wait(1)
+    waiting.release()
+    other.release()
+
+def test_interactive_preempts_auto_on_full_backend():
+    scheduler = make_scheduler(backend_limit=1)
+    auto = Holder(scheduler, PRIORITY_AUTO, 'a', 'http://a')
+    assert auto.granted.wait(1)
+
+    interactive = Holder(scheduler, PRIORITY_INTERACTIVE, 'u', 'http://a')
+    assert interactive.granted.wait(1)
+    auto.thread.join(timeout=1)
+    assert auto.cancelled
+    interactive.release()
+
+def test_paused_stream_resumes_after_interactive():
+    scheduler = make_scheduler(max_concurrency=1, preempt=PREEMPT_PAUSE)
+    auto = Holder(scheduler, PRIORITY_AUTO, 'a')
+    assert auto.granted.wait(1)
+
+    interactive = Holder(scheduler, PRIORITY_INTERACTIVE, 'u')
+    assert interactive.granted.wait(1)
+    assert scheduler.get_stats()[PRIORITY_AUTO]['paused'] == 1
+
+    interactive.release()
+    assert wait_until(lambda: scheduler.get_stats()[PRIORITY_AUTO]['running'] == 1)
+    auto.release()
+    assert not auto.cancelled
+
+def test_no_preemption_when_interactive_class_limit_blocks():
+    scheduler = make_scheduler(max_concurrency=4, interactive=2)
+    holders = [Holder(scheduler, PRIORITY_INTERACTIVE, f'u{i}') for i in range(2)]
+    holders += [Holder(scheduler, PRIORITY_AUTO, f'a{i}') for i in range(2)]
+    assert all(holder.granted.wait(1) for holder in holders)
+
+    third = Holder(scheduler, PRIORITY_INTERACTIVE, 'u2')
+    assert not third.granted.wait(0.1)
+    # 対話クラスの上限で待っているため、自動会話はキャンセルされない
+    assert scheduler.get_stats()[PRIORITY_AUTO]['running'] == 2
+    assert not any(holder.cancelled for holder in holders)
+
+    holders[0].release()
+    assert third.granted.wait(1)
+    for holder in holders[1:] + [third]:
+        holder.release()
+    assert not any(holder.cancelled for holder in holders)
+
+def test_round_robin_between_sessions():
+    scheduler = make_scheduler(max_concurrency=1)
+    blocker = Holder(scheduler, PRIORITY_AUTO, 'x')
+    assert blocker.granted.wait(1)
+    order = []
+    lock = threading.Lock()
+
+    def run(session_id, label):
+        with scheduler.slot(PRIORITY_AUTO, session_id):
+            with lock:
+                order.append(label)
+
+    threads = []
+    for session_id, label in [('a', 'a1'), ('a', 'a2'), ('b', 'b1')]:
+        thread = threading.Thread(target=run, args=(session_id, label), daemon=True)
+        thread.start()
+        threads.append(thread)
+        assert wait_until(lambda: scheduler.get_stats()[PRIORITY_AUTO]['queue_depth'] == len(threads))
+
+    blocker.release()
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ['a1', 'b1', 'a2']
+
+def test_try_acquire_does_not_wait_or_overtake():
+    scheduler = make_scheduler(auto=1, backend_limit=1)
+    busy = Holder(scheduler, PRIORITY_AUTO, 'a', 'http://a')
+    assert busy.granted.wait(1)
+    # バックエンドに空きがない場合は待たずにNoneを返す
+    assert scheduler.try_acquire(PRIORITY_INTERACTIVE, 'b', 'http://a') is None
+
+    ticket = scheduler.try_acquire(PRIORITY_INTERACTIVE, 'b', 'http://b')
+    assert ticket is not None
+    assert scheduler.get_backend_stats()['http://b']['running'] == 1
+    ticket.release()
+    ticket.release()  # 2回目の解放は無視される
+    assert scheduler.get_stats()[PRIORITY_INTERACTIVE]['completed'] == 1
+
+    # 同じクラスで待っているリクエストは追い越さない
+    waiting = Holder(scheduler, PRIORITY_AUTO, 'c', 'http://c')
+    assert wait_until(lambda: scheduler.get_stats()[PRIORITY_AUTO]['queue_depth'] == 1)
+    assert scheduler.try_acquire(PRIORITY_AUTO, 'd', 'http://d') is None
+    busy.release()
+    assert waiting.granted.wait(1)
+    waiting.release()
@@ -0,0 +1,153 @@
+"""
+シングルフライト（app.single_flight）のテスト。
+"""
+
+import queue
+import threading
+import time
+import pytest
+import app.main
+from app.main import LLMAPI, LLMAPIError
+from app.mock_backend import start_mock_backend
+from app.request_scheduler import RequestScheduler, PRIORITY_AUTO
+from app.single_flight import SingleFlightGroup
+
+REPLY_TEXT = '「シングルフライトのテストです。」'
+
+def wait_until(condition, timeout=2.0):
+    """条件が満たされるまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+class ControlledStream:
+    """テストから1レコードずつ送り出す開始関数"""
+
+    def __init__(self):
+        self.records = queue.Queue()
+        self.started = 0
+        self.closed = threading.Event()
+
+    def send(self, record):
+        self.records.put(('record', record))
+
+    def end(self):
+        self.records.put(('end', None))
+
+    def fail(self, error):
+        self.records.put(('error', error))
+
+    def __call__(self):
+        self.started += 1
+        return self.iter_records()
+
+    def iter_records(self):
+        try:
+            while True:
+                kind, payload = self.records.get()
+                if kind == 'end':
+                    return
+                if kind == 'error':
+                    raise payload
+                yield payload
+        finally:
+            self.closed.set()
+
+def test_late_subscriber_replays_from_the_start():
+    group = SingleFlightGroup()
+    stream = ControlledStream()
+    first = group.iter_records('key', stream)
+    stream.send({'n': 1})
+    stream.send({'n': 2})
+    assert next(first) == {'n': 1}
+    assert next(first) == {'n': 2}
+
+    second = group.iter_records('key', stream)
+    assert next(second) == {'n': 1}
+    stream.send({'n': 3})
+    stream.end()
+
+    assert list(second) == [{'n': 2}, {'n': 3}]
+    assert list(first) == [{'n': 3}]
+    assert stream.started == 1
+    assert group.get_stats() == {'flights': 1, 'coalesced': 1, 'cancelled': 0, 'in_flight': 0}
+
+def test_last_subscriber_leaving_cancels_the_stream():
+    group = SingleFlightGroup()
+    stream = ControlledStream()
+    first = group.iter_records('key', stream)
+    second = group.iter_records('key', stream)
+    stream.send({'n': 1})
+    assert next(first) == {'n': 1}
+    assert next(second) == {'n': 1}
+
+    # 他の購読者がいる間はストリームを継続する
+    first.close()
+    stream.send({'n': 2})
+    assert next(second) == {'n': 2}
+    assert not stream.closed.is_set()
+
+    second.close()
+    stream.send({'n': 3})
+    assert stream.closed.wait(2)
+    assert group.get_stats()['cancelled'] == 1
+
+    # 以降の同一リクエストは新しいストリームとして開始する
+    restarted = ControlledStream()
+    third = group.iter_records('key', restarted)
+    restarted.send({'n': 'new'})
+    assert next(third) == {'n': 'new'}
+    assert restarted.started == 1
+    third.close()
+
+def test_error_is_propagated_to_all_subscribers():
+    group = SingleFlightGroup()
+    stream = ControlledStream()
+    first = group.iter_records('key', stream)
+    second = group.iter_records('key', stream)
+    stream.send({'n': 1})
+    assert next(first) == {'n': 1}
+    assert next(second) == {'n': 1}
+    stream.fail(LLMAPIError('バックエンドの切断'))
+
+    for subscriber in (first, second):
+        with pytest.raises(LLMAPIError):
+            next(subscriber)
+    assert group.get_stats()['in_flight'] == 0
+
+def test_only_the_leader_takes_a_scheduler_slot(monkeypatch):
+    backend = start_mock_backend(delay=0.05, reply_text=REPLY_TEXT)
+    monkeypatch.setattr(app.main, 'URL', f'http://127.0.0.1:{backend.server_address[1]}/api/generate')
+    scheduler = RequestScheduler(max_concurrency=1, class_limits={})
+    group = SingleFlightGroup()
+    monkeypatch.setattr(app.main, 'get_request_scheduler', lambda: scheduler)
+    monkeypatch.setattr(app.main, 'get_single_flight_group', lambda: group)
+    monkeypatch.setattr(app.main, 'get_semantic_cache', lambda embed_func: None)
+
+    try:
+        leader = LLMAPI(mode='normal', session_id='a')
+        follower = LLMAPI(mode='normal', session_id='b')
+        leader_stream = leader.request_stream('こんにちは', PRIORITY_AUTO)
+        assert next(leader_stream)
+
+        # 実行枠は1つだけだが、後から参加した同一リクエストは枠を待たずに受信できる
+        result = {}
+        thread = threading.Thread(
+            target=lambda: result.update(follower.request('こんにちは', PRIORITY_AUTO)), daemon=True
+        )
+        thread.start()
+        thread.join(timeout=5)
+        assert result['response'] == REPLY_TEXT
+        assert scheduler.get_stats()[PRIORITY_AUTO]['queue_depth'] == 0
+
+        for _ in leader_stream:
+            pass
+        assert leader.chat_messages[-1]['content'] == REPLY_TEXT
+        assert group.get_stats()['coalesced'] == 1
+        assert wait_until(lambda: scheduler.get_stats()[PRIORITY_AUTO]['completed'] == 1)
+    finally:
+        backend.shutdown()
+        backend.server_close()